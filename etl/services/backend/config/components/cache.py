@@ -0,0 +1,23 @@
+import os
+
+# Without REDIS_HOST the responses of the movies API are not cached
+if os.environ.get("REDIS_HOST"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://{host}:{port}/{db}".format(
+                host=os.environ.get("REDIS_HOST"),
+                port=os.environ.get("REDIS_PORT", 6379),
+                db=os.environ.get("REDIS_DB", 0),
+            ),
+            "KEY_PREFIX": "movies_api",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        }
+    }
+
+API_CACHE_TIMEOUT = int(os.environ.get("API_CACHE_TIMEOUT", 300))
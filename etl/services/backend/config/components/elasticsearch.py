@@ -0,0 +1,13 @@
+import os
+
+# "postgres" or "elasticsearch", the index falls back to Postgres when it is stale or down
+API_READ_BACKEND = os.environ.get("API_READ_BACKEND", "postgres")
+
+ELASTICSEARCH = {
+    "hosts": f"http://{os.environ.get('ES_HOST', '127.0.0.1')}:{os.environ.get('ES_PORT', 9200)}",
+    "index_name": os.environ.get("ES_INDEX_NAME", "movies"),
+    "request_timeout": float(os.environ.get("ES_REQUEST_TIMEOUT", 2)),
+    "retry_after": float(os.environ.get("ES_RETRY_AFTER", 30)),
+    "freshness_check_interval": float(os.environ.get("ES_FRESHNESS_CHECK_INTERVAL", 30)),
+    "max_missing_ratio": float(os.environ.get("ES_MAX_MISSING_RATIO", 0.01)),
+}
@@ -56,6 +56,8 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 include(
     'components/database.py',
+    'components/cache.py',
+    'components/elasticsearch.py',
 )
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -0,0 +1,105 @@
+import base64
+import binascii
+import datetime
+import json
+import uuid
+from functools import cached_property
+
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+
+from movies.cache import list_version
+from movies.models import Filmwork
+
+ESTIMATED_COUNT_QUERY = "SELECT reltuples::bigint FROM pg_class WHERE oid = 'content.film_work'::regclass"
+
+
+def exact_count() -> int:
+    """COUNT(*) of the film works, cached until the next change of the catalogue."""
+    return cache.get_or_set(f'movies:count:{list_version()}', Filmwork.objects.count, None)
+
+
+def estimated_count() -> int:
+    """The planner's estimate, free to read, as fresh as the last (auto)vacuum / ANALYZE."""
+    with connection.cursor() as cursor:
+        cursor.execute(ESTIMATED_COUNT_QUERY)
+        row = cursor.fetchone()
+    # -1 until the table is analyzed for the first time
+    if row is None or row[0] < 0:
+        return exact_count()
+    return row[0]
+
+
+class CachedCountPaginator(Paginator):
+    """Takes the count from exact_count() instead of counting the queryset on every page."""
+
+    @cached_property
+    def count(self) -> int:
+        return exact_count()
+
+
+def encode_payload(payload: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_payload(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise BadRequest('Invalid cursor')
+    if not isinstance(payload, dict):
+        raise BadRequest('Invalid cursor')
+    return payload
+
+
+def encode_cursor(row: dict, direction: str) -> str:
+    return encode_payload({'c': row['created_at'].isoformat(), 'i': str(row['id']), 'd': direction})
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, uuid.UUID, str]:
+    payload = decode_payload(cursor)
+    try:
+        direction = payload['d']
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return datetime.datetime.fromisoformat(payload['c']), uuid.UUID(payload['i']), direction
+    except (KeyError, TypeError, ValueError):
+        raise BadRequest('Invalid cursor')
+
+
+def paginate_by_cursor(queryset, cursor: str, page_size: int) -> dict:
+    """
+    Keyset pagination on (created_at, id): every page is an index range scan
+    of page_size + 1 rows, however deep it is. An empty cursor is the first page.
+    """
+    if cursor:
+        created_at, pkey, direction = decode_cursor(cursor)
+        after = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pkey)
+        before = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pkey)
+        if direction == 'next':
+            # created_at >= bounds the range scan, the OR only trims its first rows
+            queryset = queryset.filter(Q(created_at__gte=created_at) & after)
+        else:
+            queryset = queryset.filter(Q(created_at__lte=created_at) & before)
+    else:
+        direction = 'next'
+
+    ordering = ('created_at', 'id') if direction == 'next' else ('-created_at', '-id')
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'next':
+        has_next, has_prev = has_more, bool(cursor)
+    else:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+
+    return {
+        'count': estimated_count(),
+        'prev': encode_cursor(rows[0], 'prev') if rows and has_prev else None,
+        'next': encode_cursor(rows[-1], 'next') if rows and has_next else None,
+        'results': rows,
+    }
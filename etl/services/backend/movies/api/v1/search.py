@@ -0,0 +1,172 @@
+"""
+Read path of the movies API on the Elasticsearch index the ETL maintains.
+Every failure surfaces as SearchUnavailable, upon which the views serve the
+request from Postgres: the cluster being down (it isn't asked again for
+retry_after seconds), the index holding fewer documents than Postgres has
+film works (it is being rebuilt or the ETL is far behind), or a page ES can't
+serve, like one past max_result_window.
+"""
+import math
+from time import monotonic
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.http import Http404
+from elasticsearch import ApiError, BadRequestError, Elasticsearch, TransportError
+
+from movies.api.v1.pagination import decode_payload, encode_payload, estimated_count, exact_count
+
+SEARCH_FIELDS = ['title^3', 'description', 'genres', 'actors_names', 'writers_names']
+# index.max_result_window of the index, from + size can't go past it
+MAX_RESULT_WINDOW = 10_000
+
+
+class SearchUnavailable(Exception):
+    pass
+
+
+def to_movie(source: dict) -> dict:
+    """The document of the index in the shape of the API, ordered like the Postgres results."""
+    return {
+        'id': source['id'],
+        'title': source['title'],
+        'description': source['description'],
+        # Documents indexed before the fields were added lack them until they are reloaded
+        'creation_date': source.get('creation_date'),
+        'rating': source['imdb_rating'],
+        'type': source.get('type'),
+        'genres': sorted(genre for genre in source['genres'] if genre is not None),
+        'actors': sorted(source['actors_names']),
+        'directors': sorted(director['full_name'] for director in source['directors']),
+        'writers': sorted(source['writers_names']),
+    }
+
+
+def is_search_cursor(cursor: str) -> bool:
+    return bool(cursor) and 'a' in decode_payload(cursor)
+
+
+def encode_search_cursor(sort_values: list) -> str:
+    return encode_payload({'a': sort_values})
+
+
+def decode_search_cursor(cursor: str) -> list:
+    sort_values = decode_payload(cursor).get('a')
+    if not isinstance(sort_values, list) or not sort_values:
+        raise BadRequest('Invalid cursor')
+    return sort_values
+
+
+def paginate_by_id(queryset, cursor: str, page_size: int) -> dict:
+    """
+    Carries on a crawl started on the index from Postgres. Without a search
+    query the index is sorted by id, which is a keyset on the primary key here.
+    """
+    sort_values = decode_search_cursor(cursor)
+    if len(sort_values) != 1:
+        raise BadRequest('The search is unavailable, start over from the first page')
+    rows = list(queryset.filter(id__gt=sort_values[0]).order_by('id')[:page_size + 1])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    return {
+        'count': estimated_count(),
+        'prev': None,
+        'next': encode_search_cursor([str(rows[-1]['id'])]) if has_next else None,
+        'results': rows,
+    }
+
+
+class SearchBackend:
+    def __init__(self, options: dict) -> None:
+        self.options = options
+        self._client: Optional[Elasticsearch] = None
+        self._down_until = 0.0
+        self._checked_until = 0.0
+        self._fresh = False
+
+    @property
+    def client(self) -> Elasticsearch:
+        if self._client is None:
+            self._client = Elasticsearch(
+                self.options['hosts'],
+                request_timeout=self.options['request_timeout'],
+                max_retries=0
+            )
+        return self._client
+
+    def get_movie(self, pk) -> Optional[dict]:
+        """None when the film work isn't indexed yet."""
+        self.ensure_fresh()
+        response = self._call(self.client.options(ignore_status=404).get, id=str(pk))
+        return to_movie(response['_source']) if response.get('found') else None
+
+    def list_page(self, page: str, page_size: int, query: str) -> dict:
+        if not str(page).isdigit() or int(page) < 1:
+            # 'last' and the invalid pages are left to the Postgres paginator
+            raise SearchUnavailable(f'Page {page!r} is served by Postgres')
+        page = int(page)
+        if page * page_size > MAX_RESULT_WINDOW:
+            raise SearchUnavailable(f'Page {page} is past the result window of the index')
+
+        self.ensure_fresh()
+        hits = self._search(query, size=page_size, from_=(page - 1) * page_size, track_total_hits=True)
+        count = hits['total']['value']
+        total_pages = max(1, math.ceil(count / page_size))
+        if page > total_pages:
+            raise Http404
+        return {
+            'count': count,
+            'total_pages': total_pages,
+            'prev': page - 1 if page > 1 else None,
+            'next': page + 1 if page < total_pages else None,
+            'results': [to_movie(hit['_source']) for hit in hits['hits']],
+        }
+
+    def cursor_page(self, cursor: str, page_size: int, query: str) -> dict:
+        """search_after paging, forward only."""
+        search_after = decode_search_cursor(cursor) if cursor else None
+        self.ensure_fresh()
+        hits = self._search(query, size=page_size + 1, search_after=search_after)
+        results = hits['hits'][:page_size]
+        has_next = len(hits['hits']) > page_size
+        return {
+            'count': hits['total']['value'],
+            'prev': None,
+            'next': encode_search_cursor(results[-1]['sort']) if has_next else None,
+            'results': [to_movie(hit['_source']) for hit in results],
+        }
+
+    def ensure_fresh(self) -> None:
+        now = monotonic()
+        if now >= self._checked_until:
+            indexed = self._call(self.client.count)['count']
+            expected = exact_count()
+            self._fresh = indexed >= expected * (1 - self.options['max_missing_ratio'])
+            self._checked_until = now + self.options['freshness_check_interval']
+        if not self._fresh:
+            raise SearchUnavailable('The index is behind Postgres')
+
+    def _search(self, query: str, **kwargs) -> dict:
+        if query:
+            body = {'multi_match': {'query': query, 'fields': SEARCH_FIELDS}}
+            sort = ['_score', {'id': 'asc'}]
+        else:
+            body = {'match_all': {}}
+            sort = [{'id': 'asc'}]
+        return self._call(self.client.search, query=body, sort=sort, **kwargs)['hits']
+
+    def _call(self, method, **kwargs):
+        if monotonic() < self._down_until:
+            raise SearchUnavailable('Elasticsearch is marked as down')
+        try:
+            return method(index=self.options['index_name'], **kwargs)
+        except BadRequestError:
+            # search_after values of a cursor that was tampered with
+            raise BadRequest('Invalid search request')
+        except (ApiError, TransportError) as exc:
+            self._down_until = monotonic() + self.options['retry_after']
+            raise SearchUnavailable(str(exc)) from exc
+
+
+search_backend = SearchBackend(settings.ELASTICSEARCH)
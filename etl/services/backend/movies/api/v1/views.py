@@ -1,10 +1,39 @@
-from django.http import JsonResponse
+import json
+import logging
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef, Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.views import View
 from django.views.generic.list import BaseListView
 from django.views.generic.detail import BaseDetailView
-from django.db.models import Q
-from django.contrib.postgres.aggregates import ArrayAgg
 
-from movies.models import Filmwork, Role
+from movies.api.v1.conditional import ConditionalResponseMixin, catalogue_etag, film_work_etag
+from movies.api.v1.pagination import CachedCountPaginator, paginate_by_cursor
+from movies.api.v1.search import SearchUnavailable, is_search_cursor, paginate_by_id, search_backend
+from movies.cache import detail_cache_key, list_cache_key
+from movies.models import Filmwork, GenreFilmwork, PersonFilmwork, Role
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 1000
+
+# The fields of the Movie schema, the same whether the index or Postgres serves them
+MOVIE_FIELDS = ('id', 'title', 'description', 'creation_date', 'rating', 'type')
+
+ROLE_FIELDS = {
+    Role.ACTOR: 'actors',
+    Role.DIRECTOR: 'directors',
+    Role.WRITER: 'writers',
+}
 
 
 class FilmworkApiMixin:
@@ -12,40 +41,120 @@ class FilmworkApiMixin:
     http_method_names = ['get']
 
     def get_queryset(self):
-        qs = Filmwork.objects.prefetch_related('genres', 'persons').values().annotate(
-            genres=ArrayAgg(
-                'genres__name',
-                distinct=True
-            ),
-            actors=ArrayAgg(
-                'persons__full_name',
-                distinct=True,
-                filter=Q(personfilmwork__role=Role.DIRECTOR),
-            ),
-            directors=ArrayAgg(
-                'persons__full_name',
-                distinct=True,
-                filter=Q(personfilmwork__role=Role.DIRECTOR),
-            ),
-            writers=ArrayAgg(
-                'persons__full_name',
-                distinct=True,
-                filter=Q(personfilmwork__role=Role.WRITER),
-            ),
-        )
+        qs = Filmwork.objects.values(*MOVIE_FIELDS)
+        query = self.request.GET.get('query')
+        if query:
+            qs = qs.filter(Q(title__icontains=query) | Q(description__icontains=query))
         return qs
 
+    @staticmethod
+    def read_from_search() -> bool:
+        return settings.API_READ_BACKEND == 'elasticsearch'
+
+    @staticmethod
+    def attach_relations(film_works: list) -> list:
+        """
+        Fills in the genres and the persons by role of a page of film works
+        with one flat query per M2M table, instead of aggregating them per row.
+        """
+        ids = [film_work['id'] for film_work in film_works]
+        relations = defaultdict(lambda: defaultdict(set))
+        genres = GenreFilmwork.objects.filter(film_work_id__in=ids).values_list('film_work_id', 'genre__name')
+        for film_work_id, name in genres:
+            relations[film_work_id]['genres'].add(name)
+        persons = PersonFilmwork.objects.filter(film_work_id__in=ids).values_list(
+            'film_work_id', 'role', 'person__full_name'
+        )
+        for film_work_id, role, full_name in persons:
+            if role in ROLE_FIELDS:
+                relations[film_work_id][ROLE_FIELDS[role]].add(full_name)
+
+        for film_work in film_works:
+            related = relations[film_work['id']]
+            film_work['genres'] = sorted(related['genres'])
+            for field in ROLE_FIELDS.values():
+                film_work[field] = sorted(related[field])
+        return film_works
+
     def render_to_response(self, context, **response_kwargs):
         return JsonResponse(context)
 
 
-class MoviesListApi(FilmworkApiMixin, BaseListView):
+class CachedResponseMixin:
+    """
+    Serves the rendered JSON from the cache, movies/signals.py drops it on changes.
+    The ETag is cached along with it, so a cache hit answers If-None-Match
+    without asking the database for the change markers.
+    """
+
+    def get_cache_key(self) -> str:
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        # The signals drop the entries before the ETL reindexed the change, a
+        # response read from the index would be cached stale for API_CACHE_TIMEOUT
+        if self.read_from_search():
+            return super().get(request, *args, **kwargs)
+        key = self.get_cache_key()
+        cached = cache.get(key)
+        if cached is not None:
+            etag = cached['etag']
+            response = get_conditional_response(request, etag=etag) if etag else None
+            if response is None:
+                response = HttpResponse(cached['content'], content_type='application/json')
+            if etag:
+                response['ETag'] = etag
+            return response
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, {'content': response.content, 'etag': response.get('ETag')}, settings.API_CACHE_TIMEOUT)
+        return response
+
+
+class MoviesListApi(CachedResponseMixin, ConditionalResponseMixin, FilmworkApiMixin, BaseListView):
     paginate_by = 50
+    paginator_class = CachedCountPaginator
+
+    def get_etag(self):
+        return catalogue_etag(self.request.get_full_path())
+
+    def get_cache_key(self) -> str:
+        return list_cache_key(self.request.path, self.request.GET)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        # The cached count is the one of the whole catalogue
+        if self.request.GET.get('query'):
+            return Paginator(queryset, per_page, **kwargs)
+        return super().get_paginator(queryset, per_page, **kwargs)
 
     def get_context_data(self, *, object_list=None, **kwargs):
+        query = self.request.GET.get('query', '')
+        cursor = self.request.GET.get('cursor')
+        # A (created_at, id) cursor handed out while the index was down is finished in Postgres
+        if self.read_from_search() and (not cursor or is_search_cursor(cursor)):
+            try:
+                if cursor is not None:
+                    return search_backend.cursor_page(cursor, self.paginate_by, query)
+                return search_backend.list_page(self.request.GET.get('page', 1), self.paginate_by, query)
+            except SearchUnavailable as exc:
+                logger.warning(f'Serving the movies list from Postgres: {exc}')
+
         qs = self.get_queryset()
+        if cursor is not None:
+            if is_search_cursor(cursor):
+                context = paginate_by_id(qs, cursor, self.paginate_by)
+            else:
+                # created_at is only selected for the cursors
+                context = paginate_by_cursor(qs.values(*MOVIE_FIELDS, 'created_at'), cursor, self.paginate_by)
+                for row in context['results']:
+                    del row['created_at']
+            if query:
+                context['count'] = qs.count()
+            self.attach_relations(context['results'])
+            return context
+        # Sorted like the index, page N holds the same films whichever backend serves it
         paginator, page, queryset, is_paginated = self.paginate_queryset(
-            qs,
+            qs.order_by('id'),
             self.paginate_by
         )
         context = {
@@ -53,11 +162,61 @@ class MoviesListApi(FilmworkApiMixin, BaseListView):
             'total_pages': page.paginator.num_pages,
             'prev': page.previous_page_number() if page.number > 1 else None,
             'next': page.next_page_number() if page.has_next() else None,
-            'results': list(queryset),
+            'results': self.attach_relations(list(queryset)),
         }
         return context
 
 
-class MoviesDetailApi(FilmworkApiMixin, BaseDetailView):    
+class MoviesDetailApi(CachedResponseMixin, ConditionalResponseMixin, FilmworkApiMixin, BaseDetailView):
+    def get_etag(self):
+        return film_work_etag(self.kwargs['pk'])
+
+    def get_cache_key(self) -> str:
+        return detail_cache_key(self.kwargs['pk'])
+
     def get_context_data(self, **kwargs):
-        return self.get_object()
+        if self.read_from_search():
+            try:
+                movie = search_backend.get_movie(self.kwargs['pk'])
+                if movie is not None:
+                    return movie
+            except SearchUnavailable as exc:
+                logger.warning(f'Serving the movie from Postgres: {exc}')
+        return self.attach_relations([self.get_object()])[0]
+
+
+class MoviesExportApi(FilmworkApiMixin, View):
+    """
+    The whole catalogue as NDJSON, one film work per line, streamed from a
+    server-side cursor chunk by chunk. ?updated_since= keeps the film works
+    changed since then, including a person or a genre added to them or
+    renamed. A removed person or genre leaves no timestamp behind, so a film
+    work that only lost one is not reported.
+    """
+
+    def get(self, request, *args, **kwargs):
+        qs = Filmwork.objects.values(*MOVIE_FIELDS)
+        updated_since = request.GET.get('updated_since')
+        if updated_since:
+            since = parse_datetime(updated_since)
+            if since is None:
+                raise BadRequest('updated_since is not an ISO 8601 datetime')
+            qs = qs.filter(
+                Q(updated_at__gte=since)
+                | Exists(PersonFilmwork.objects.filter(
+                    Q(created_at__gte=since) | Q(person__updated_at__gte=since), film_work=OuterRef('pk')
+                ))
+                | Exists(GenreFilmwork.objects.filter(
+                    Q(created_at__gte=since) | Q(genre__updated_at__gte=since), film_work=OuterRef('pk')
+                ))
+            )
+        rows = qs.order_by('updated_at', 'id').iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(self.export_lines(rows), content_type='application/x-ndjson')
+        # Otherwise nginx buffers the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def export_lines(self, rows):
+        while chunk := list(islice(rows, EXPORT_CHUNK_SIZE)):
+            self.attach_relations(chunk)
+            yield ''.join(json.dumps(film_work, cls=DjangoJSONEncoder) + '\n' for film_work in chunk)
@@ -0,0 +1,34 @@
+import hashlib
+import time
+from typing import Iterable
+
+from django.core.cache import cache
+
+# Every cached list page is keyed by this version, bumping it drops them all at once.
+# A timestamp rather than a counter: a version evicted from the cache must not
+# come back as a value older pages were stored under.
+LIST_VERSION_KEY = 'movies:list:version'
+
+
+def list_version() -> int:
+    return cache.get_or_set(LIST_VERSION_KEY, time.time_ns, None)
+
+
+def list_cache_key(path: str, query_params) -> str:
+    query = '&'.join(
+        f'{name}={value}'
+        for name in sorted(query_params)
+        for value in query_params.getlist(name)
+    )
+    digest = hashlib.md5(f'{path}?{query}'.encode()).hexdigest()
+    return f'movies:list:{list_version()}:{digest}'
+
+
+def detail_cache_key(pk) -> str:
+    return f'movies:detail:{pk}'
+
+
+def invalidate_film_works(film_work_ids: Iterable) -> None:
+    cache.delete_many([detail_cache_key(pk) for pk in film_work_ids])
+    # Any change can move a film work between pages or change the count
+    cache.set(LIST_VERSION_KEY, time.time_ns(), None)
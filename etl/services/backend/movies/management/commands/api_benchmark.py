@@ -0,0 +1,70 @@
+"""
+Compares the queries and the latency of a movies list page assembled from
+per-row ArrayAgg annotations (the old FilmworkApiMixin) with the batched
+assembly the API uses now. Both page the same id-ordered queryset through a
+plain Paginator, i.e. with an uncached COUNT(*), and bypass the response cache.
+
+    python manage.py api_benchmark --pages 20 --repeat 5
+"""
+from statistics import median
+from time import perf_counter
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+
+from movies.api.v1.views import MoviesListApi
+from movies.models import Filmwork, Role
+
+
+def film_works():
+    return Filmwork.objects.values().order_by('id')
+
+
+def array_agg_page(page: int, page_size: int) -> list:
+    queryset = film_works().annotate(
+        genres=ArrayAgg('genres__name', distinct=True),
+        actors=ArrayAgg('persons__full_name', distinct=True, filter=Q(personfilmwork__role=Role.ACTOR)),
+        directors=ArrayAgg('persons__full_name', distinct=True, filter=Q(personfilmwork__role=Role.DIRECTOR)),
+        writers=ArrayAgg('persons__full_name', distinct=True, filter=Q(personfilmwork__role=Role.WRITER)),
+    )
+    return list(Paginator(queryset, page_size).page(page).object_list)
+
+
+def batched_page(page: int, page_size: int) -> list:
+    film_works_page = list(Paginator(film_works(), page_size).page(page).object_list)
+    return MoviesListApi.attach_relations(film_works_page)
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the ArrayAgg list page against the batched assembly of the movies API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        pages = range(1, options['pages'] + 1)
+        self.stdout.write(f'{"assembly":>10} {"queries":>8} {"p50 ms":>9} {"p99 ms":>9}')
+        for name, run in (('array_agg', array_agg_page), ('batched', batched_page)):
+            latencies, queries = [], []
+            for _ in range(options['repeat']):
+                for page in pages:
+                    with CaptureQueriesContext(connection) as captured:
+                        started_at = perf_counter()
+                        run(page, options['page_size'])
+                        latencies.append(perf_counter() - started_at)
+                    queries.append(len(captured.captured_queries))
+            self.stdout.write(
+                f'{name:>10} {median(queries):>8} '
+                f'{percentile(latencies, 0.50) * 1000:>9.2f} {percentile(latencies, 0.99) * 1000:>9.2f}'
+            )
@@ -0,0 +1,173 @@
+"""
+Prints the EXPLAIN plans of the queries the ETL runs against the content
+schema and flags the sequential scans among them. Save a run before applying
+the index migration and compare with it afterwards:
+
+    python manage.py index_audit --analyze --save before.json
+    python manage.py migrate movies
+    python manage.py index_audit --analyze --baseline before.json
+"""
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+ETL_TABLES = ('film_work', 'person', 'genre')
+
+# Mirrors etl/services/etl/utils/sql_queries.py
+EXTRACT_QUERY = """
+    SELECT id, updated_at FROM content.{table}
+    WHERE (updated_at, id) > (%(updated_at)s::timestamptz, %(id)s::uuid)
+    ORDER BY updated_at, id
+    LIMIT %(limit)s
+"""
+
+FILM_WORK_IDS_QUERIES = {
+    'person': """
+        SELECT DISTINCT film_work_id FROM content.person_film_work
+        WHERE person_id = ANY(%(pkeys)s::uuid[])
+    """,
+    'genre': """
+        SELECT DISTINCT film_work_id FROM content.genre_film_work
+        WHERE genre_id = ANY(%(pkeys)s::uuid[])
+    """,
+}
+
+ENRICH_QUERY = """
+    SELECT
+        film_work.id,
+        film_work.title,
+        COALESCE (
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'person_role', pfw.role,
+                    'person_id', person.id,
+                    'person_name', person.full_name
+                )
+            ) FILTER (WHERE person.id is not null),
+            '[]'
+        ) as persons,
+        array_agg(DISTINCT genre.name) as genres
+    FROM content.film_work
+        LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = film_work.id
+        LEFT JOIN content.person ON person.id = pfw.person_id
+        LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = film_work.id
+        LEFT JOIN content.genre  ON genre.id = gfw.genre_id
+    WHERE film_work.id = ANY(%(pkeys)s::uuid[])
+    GROUP BY film_work.id
+"""
+
+# A checkpoint `limit` rows behind the newest row, the steady state of the ETL
+CHECKPOINT_QUERY = """
+    SELECT updated_at, id FROM content.{table}
+    ORDER BY updated_at DESC, id DESC
+    OFFSET %(limit)s LIMIT 1
+"""
+
+SAMPLE_QUERY = """
+    SELECT id FROM content.{table}
+    ORDER BY updated_at DESC
+    LIMIT %(limit)s
+"""
+
+SCAN_NODES = ('Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+
+
+class Command(BaseCommand):
+    help = 'Reports the EXPLAIN plans of the ETL queries and the sequential scans among them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='run the queries (EXPLAIN ANALYZE)')
+        parser.add_argument('--page-size', type=int, default=1000, help='LIMIT of the extract queries')
+        parser.add_argument('--sample', type=int, default=100, help='ids passed to the ANY() lookups')
+        parser.add_argument('--save', help='write the report to this JSON file')
+        parser.add_argument('--baseline', help='JSON report of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        report = {}
+        with connection.cursor() as cursor:
+            for name, query, params in self.queries(cursor, options['page_size'], options['sample']):
+                plan = self.explain(cursor, query, params, options['analyze'])
+                report[name] = plan
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write('\n'.join(plan['lines']))
+                for scan in plan['scans']:
+                    if scan.startswith('Seq Scan'):
+                        self.stdout.write(self.style.WARNING(f'  ! {scan}'))
+                self.stdout.write('')
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                self.compare(json.load(baseline_file), report)
+
+        if options['save']:
+            with open(options['save'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+
+    def queries(self, cursor, page_size: int, sample: int):
+        for table in ETL_TABLES:
+            cursor.execute(CHECKPOINT_QUERY.format(table=table), {'limit': page_size})
+            row = cursor.fetchone()
+            # Fewer rows than a page: the ETL scans the whole table from the start
+            updated_at, pkey = row if row else ('-infinity', '00000000-0000-0000-0000-000000000000')
+            yield (
+                f'extract {table}',
+                EXTRACT_QUERY.format(table=table),
+                {'updated_at': updated_at, 'id': pkey, 'limit': page_size}
+            )
+
+        for table, query in FILM_WORK_IDS_QUERIES.items():
+            yield f'{table} -> film_work ids', query, {'pkeys': self.sample(cursor, table, sample)}
+
+        yield 'enrich film_work', ENRICH_QUERY, {'pkeys': self.sample(cursor, 'film_work', sample)}
+
+    @staticmethod
+    def sample(cursor, table: str, size: int) -> list:
+        cursor.execute(SAMPLE_QUERY.format(table=table), {'limit': size})
+        return [str(pkey) for pkey, in cursor.fetchall()]
+
+    def explain(self, cursor, query: str, params: dict, analyze: bool) -> dict:
+        explain_options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+        cursor.execute(f'EXPLAIN ({explain_options}) {query}', params)
+        result = cursor.fetchone()[0]
+        if isinstance(result, str):
+            result = json.loads(result)
+        root = result[0]
+        lines, scans = [], []
+        self.walk(root['Plan'], 0, lines, scans)
+        return {
+            'lines': lines,
+            'scans': scans,
+            'cost': root['Plan']['Total Cost'],
+            'execution_ms': root.get('Execution Time'),
+        }
+
+    def walk(self, node: dict, depth: int, lines: list, scans: list) -> None:
+        label = node['Node Type']
+        if 'Index Name' in node:
+            label += f' using {node["Index Name"]}'
+        if 'Relation Name' in node:
+            label += f' on {node["Relation Name"]}'
+        details = f'cost={node["Startup Cost"]:.2f}..{node["Total Cost"]:.2f} rows={node["Plan Rows"]}'
+        if 'Actual Total Time' in node:
+            details += f' actual={node["Actual Total Time"]:.3f}ms rows={node["Actual Rows"]}'
+        lines.append(f'{"  " * depth}-> {label} ({details})')
+        if node['Node Type'] in SCAN_NODES:
+            scans.append(label)
+        for child in node.get('Plans', ()):
+            self.walk(child, depth + 1, lines, scans)
+
+    def compare(self, baseline: dict, report: dict) -> None:
+        self.stdout.write(self.style.MIGRATE_HEADING('Compared with the baseline'))
+        for name, after in report.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            line = f'{name}: cost {before["cost"]:.2f} -> {after["cost"]:.2f}'
+            if before['execution_ms'] is not None and after['execution_ms'] is not None:
+                line += f', {before["execution_ms"]:.3f}ms -> {after["execution_ms"]:.3f}ms'
+            self.stdout.write(line)
+            for scan in sorted(set(before['scans']) - set(after['scans'])):
+                self.stdout.write(f'  - {scan}')
+            for scan in sorted(set(after['scans']) - set(before['scans'])):
+                self.stdout.write(f'  + {scan}')
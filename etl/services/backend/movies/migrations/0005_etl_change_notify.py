@@ -0,0 +1,42 @@
+from django.db import migrations
+
+ETL_TABLES = ('film_work', 'person', 'genre')
+
+create_triggers = [
+    """
+    CREATE OR REPLACE FUNCTION content.notify_etl_change() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('etl_changes', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+] + [
+    f"""
+    CREATE TRIGGER {table}_notify_etl_change
+    AFTER INSERT OR UPDATE ON content.{table}
+    FOR EACH STATEMENT EXECUTE FUNCTION content.notify_etl_change();
+    """
+    for table in ETL_TABLES
+]
+
+drop_triggers = [
+    f"DROP TRIGGER IF EXISTS {table}_notify_etl_change ON content.{table};"
+    for table in ETL_TABLES
+] + [
+    "DROP FUNCTION IF EXISTS content.notify_etl_change();",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_alter_filmwork_creation_date_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=create_triggers,
+            reverse_sql=drop_triggers,
+        ),
+    ]
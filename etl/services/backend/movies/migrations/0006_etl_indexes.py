@@ -0,0 +1,35 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, but it doesn't
+    # block writes to the tables while the indexes are built
+    atomic = False
+
+    dependencies = [
+        ('movies', '0005_etl_change_notify'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='filmwork',
+            index=models.Index(fields=['updated_at', 'id'], name='film_work_updated_at_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='person',
+            index=models.Index(fields=['updated_at', 'id'], name='person_updated_at_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='genre',
+            index=models.Index(fields=['updated_at', 'id'], name='genre_updated_at_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='genrefilmwork',
+            index=models.Index(fields=['film_work', 'genre'], name='genre_film_work_film_work_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='personfilmwork',
+            index=models.Index(fields=['person', 'film_work'], name='person_film_work_person_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('movies', '0006_etl_indexes'),
+    ]
+
+    operations = [
+        # Keyset pagination of the movies list API
+        AddIndexConcurrently(
+            model_name='filmwork',
+            index=models.Index(fields=['created_at', 'id'], name='film_work_created_at_id_idx'),
+        ),
+    ]
@@ -36,6 +36,9 @@ class Genre(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = "content\".\"genre"
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='genre_updated_at_id_idx'),
+        ]
         verbose_name = _('genre')
         verbose_name_plural = _('genres')
 
@@ -48,6 +51,9 @@ class Person(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = "content\".\"person"
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='person_updated_at_id_idx'),
+        ]
         verbose_name = _('person')
         verbose_name_plural = _('persons')
 
@@ -72,6 +78,10 @@ class Filmwork(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = "content\".\"film_work"
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='film_work_updated_at_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='film_work_created_at_id_idx'),
+        ]
         verbose_name = _('film_work')
         verbose_name_plural = _('film_works')
 
@@ -91,6 +101,9 @@ class GenreFilmwork(UUIDMixin):
         verbose_name = _('genre_film_work')
         verbose_name_plural = _('genre_film_works')
         unique_together = ['genre', 'film_work']
+        indexes = [
+            models.Index(fields=['film_work', 'genre'], name='genre_film_work_film_work_idx'),
+        ]
 
 
 class PersonFilmwork(UUIDMixin):
@@ -106,3 +119,6 @@ class PersonFilmwork(UUIDMixin):
         verbose_name = _('person_film_work')
         verbose_name_plural = _('person_film_works')
         unique_together = ['film_work', 'person', 'role']
+        indexes = [
+            models.Index(fields=['person', 'film_work'], name='person_film_work_person_idx'),
+        ]
@@ -1,10 +1,55 @@
 import datetime
+from django.db import transaction
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from .models import Filmwork
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from .cache import invalidate_film_works
+from .models import Filmwork, Genre, GenreFilmwork, Person, PersonFilmwork
 
 
 @receiver(post_save, sender=Filmwork)
 def attention(sender, instance, created, **kwargs):
     if created and instance.creation_date == datetime.date.today():
         print(f"Сегодня премьера {instance.title}! 🥳")
+
+
+def invalidate_on_commit(film_work_ids) -> None:
+    # After the commit, so a concurrent request can't cache the old rows again
+    film_work_ids = list(film_work_ids)
+    transaction.on_commit(lambda: invalidate_film_works(film_work_ids))
+
+
+@receiver(post_save, sender=Filmwork)
+@receiver(post_delete, sender=Filmwork)
+def invalidate_film_work(sender, instance, **kwargs):
+    invalidate_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Genre)
+def invalidate_related_film_works(sender, instance, **kwargs):
+    through = PersonFilmwork if sender is Person else GenreFilmwork
+    lookup = {sender._meta.model_name: instance}
+    invalidate_on_commit(through.objects.filter(**lookup).values_list('film_work_id', flat=True))
+
+
+@receiver(post_save, sender=PersonFilmwork)
+@receiver(post_delete, sender=PersonFilmwork)
+@receiver(post_save, sender=GenreFilmwork)
+@receiver(post_delete, sender=GenreFilmwork)
+def invalidate_film_work_relation(sender, instance, **kwargs):
+    invalidate_on_commit([instance.film_work_id])
+
+
+@receiver(m2m_changed, sender=PersonFilmwork)
+@receiver(m2m_changed, sender=GenreFilmwork)
+def invalidate_film_work_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    # add() / remove() / clear() bypass the post_save and post_delete of the through model
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_on_commit([instance.pk])
+    elif pk_set is not None:
+        invalidate_on_commit(pk_set)
+    else:
+        lookup = {instance._meta.model_name: instance}
+        invalidate_on_commit(sender.objects.filter(**lookup).values_list('film_work_id', flat=True))
@@ -0,0 +1,335 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from typing import Callable, Optional
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.string import TextLoader
+
+from elasticsearch import AsyncElasticsearch
+
+from utils.backoff import async_backoff
+from utils.batcher import AdaptiveBatcher
+from utils.bulk import AsyncBulkLoader
+from utils.change_listener import ChangeListener
+from utils.content_hash import ContentHashStore
+from utils.dedup import EnrichedFilms
+from utils.partial_updates import PartialUpdate, genres_update, person_names_update
+from utils.sql_queries import (
+    sql_extract_last_updated_table_query,
+    sql_extract_updated_film_work_records_query,
+    sql_extract_film_work_ids_queries,
+    sql_extract_film_work_genres_query,
+    sql_extract_person_names_query,
+    sql_transaction_started_at_query,
+    schema
+)
+from utils.logger import logger
+from utils.metrics import metrics
+from utils.transform import TRANSFORM_ENGINES, TransformedDocument
+
+from state.main import State
+
+from config import (
+    DSL,
+    ES,
+    ETL
+)
+
+from load_data import (
+    BACKOFF_START_SLEEP_TIME,
+    BACKOFF_FACTOR,
+    BACKOFF_BORDER_SLEEP_TIME,
+    ETL_SLEEP_TIME,
+    ETL_NOTIFY_POLL_INTERVAL,
+    ETL_CURSOR_ITERSIZE,
+    ETL_PARTIAL_UPDATES,
+    PG_CONNECT_TIMEOUT,
+    PG_KEEPALIVES_IDLE,
+    PG_STATEMENT_TIMEOUT,
+    bulk_loader_options,
+    clear_content_hashes_on_reset,
+    create_batcher,
+    create_change_listener,
+    create_content_hash_store,
+    create_enriched_films,
+    create_state,
+    get_checkpoint,
+    log_content_hash_counters,
+    make_index_actions,
+    page_size,
+    record_indexing_lag,
+    start_metrics_exporter
+)
+
+"""
+The same extract -> enrich -> transform -> load chain as load_data.py, but every
+stage is an asyncio task and the stages are connected by bounded queues, so the
+waits on Postgres and Elasticsearch overlap.
+
+Messages between the stages are (scan, rows, checkpoint) tuples:
+rows is a batch of data or a PartialUpdate, a None batch with a checkpoint acknowledges a chunk of
+changed ids and a None batch without a checkpoint ends the scan of a table.
+"""
+
+ETL_ASYNC_QUEUE_SIZE = int(ETL["async_queue_size"])
+
+
+@dataclass
+class Scan:
+    table_name: str
+    started_at: Optional[datetime] = None
+    failed: bool = False
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+def render_table(query: str, table_name: str) -> str:
+    # psycopg 3 has no AsIs, the table names come from ETL["extract_tables"]
+    return query.replace('%(table)s', f'{schema}.{table_name}')
+
+async def execute_page(pg_conn: psycopg.AsyncConnection, query: str, query_vars: dict, stage: str) -> list:
+    # prepare=True: psycopg keeps a server-side prepared statement per query text on the connection
+    with metrics.timer('etl_stage_seconds', stage=stage):
+        cursor = await pg_conn.execute(query, query_vars, prepare=True)
+        results = await cursor.fetchall()
+    metrics.inc('etl_rows_total', len(results), stage=stage)
+    return results
+
+async def fetch_page(cursor: psycopg.AsyncCursor, size: int, stage: str) -> list:
+    with metrics.timer('etl_stage_seconds', stage=stage):
+        results = await cursor.fetchmany(size)
+    metrics.inc('etl_rows_total', len(results), stage=stage)
+    return results
+
+@async_backoff(BACKOFF_START_SLEEP_TIME, BACKOFF_FACTOR, BACKOFF_BORDER_SLEEP_TIME)
+async def connect_to_pg() -> psycopg.AsyncConnection:
+    pg_conn = await psycopg.AsyncConnection.connect(
+        **DSL,
+        row_factory=dict_row,
+        connect_timeout=PG_CONNECT_TIMEOUT,
+        options=f'-c statement_timeout={PG_STATEMENT_TIMEOUT}',
+        keepalives=1,
+        keepalives_idle=PG_KEEPALIVES_IDLE,
+        keepalives_interval=PG_KEEPALIVES_IDLE,
+        keepalives_count=3
+    )
+    # Keep uuids as strings like psycopg2 does, the transform engines expect them
+    pg_conn.adapters.register_loader('uuid', TextLoader)
+    return pg_conn
+
+@async_backoff(BACKOFF_START_SLEEP_TIME, BACKOFF_FACTOR, BACKOFF_BORDER_SLEEP_TIME)
+async def connect_to_es(hash_store: Optional[ContentHashStore] = None) -> AsyncElasticsearch:
+    es_conn = AsyncElasticsearch(ES["hosts"])
+    if not await es_conn.indices.exists(index=ES["index_name"]):
+        await es_conn.indices.create(index=ES["index_name"], settings=ES["index_settings"], mappings=ES["index_mappings"])
+        if hash_store is not None:
+            # The stored hashes describe documents of an index that is gone
+            hash_store.clear()
+    else:
+        # The mapping is strict, fields added to it since the index was created must be put first
+        await es_conn.indices.put_mapping(index=ES["index_name"], properties=ES["index_mappings"]["properties"])
+    return es_conn
+
+async def extract_changed_movies(
+    state: State,
+    pg_conn: psycopg.AsyncConnection,
+    listener: Optional[ChangeListener],
+    batcher: AdaptiveBatcher,
+    enriched_films: EnrichedFilms,
+    output: asyncio.Queue
+) -> None:
+    tables = ETL["extract_tables"]
+    while True:
+        enriched_films.reset()
+        for table_name in tables:
+            scan = Scan(table_name)
+            checkpoint = get_checkpoint(state, table_name)
+            logger.info(f'[{table_name}] Fetching data updated after: {checkpoint["updated_at"]} ({checkpoint["id"]})\n')
+
+            try:
+                cursor = await pg_conn.execute(sql_transaction_started_at_query)
+                scan.started_at = (await cursor.fetchone())['started_at']
+
+                extract_query = render_table(sql_extract_last_updated_table_query, table_name)
+                while not scan.failed and (results := await execute_page(
+                    pg_conn, extract_query, {**checkpoint, 'limit': page_size(batcher)}, 'extract'
+                )):
+                    checkpoint = {
+                        'updated_at': str(results[-1]['updated_at']),
+                        'id': str(results[-1]['id'])
+                    }
+                    await output.put((scan, [record['id'] for record in results], checkpoint))
+
+                await pg_conn.commit()
+            except psycopg.OperationalError:
+                scan.failed = True
+                await pg_conn.close()
+                pg_conn = await connect_to_pg()
+
+            await output.put((scan, None, None))
+            await scan.done.wait()
+            state.commit(force=True)
+
+            if listener is None:
+                await asyncio.sleep(ETL_SLEEP_TIME)
+        if listener is not None:
+            # The listener is a blocking psycopg2 connection, wait for it off the event loop
+            tables = await asyncio.to_thread(listener.wait, ETL_NOTIFY_POLL_INTERVAL)
+
+async def enrich_film_works(
+    pg_conn: psycopg.AsyncConnection,
+    scan: Scan,
+    film_work_ids: list[str],
+    changed_at: datetime,
+    batcher: AdaptiveBatcher,
+    enriched_films: EnrichedFilms,
+    output: asyncio.Queue
+) -> None:
+    film_work_ids = enriched_films.filter(film_work_ids, changed_at)
+    if not film_work_ids:
+        return
+
+    results = await execute_page(pg_conn, sql_extract_updated_film_work_records_query, {'film_work_ids': film_work_ids}, 'enrich')
+    while results:
+        await output.put((scan, results[:batcher.size], None))
+        results = results[batcher.size:]
+    enriched_films.add(film_work_ids, scan.started_at)
+
+async def extract_person_names_update(pg_conn: psycopg.AsyncConnection, pkeys: list[str]) -> PartialUpdate:
+    cursor = await pg_conn.execute(sql_extract_person_names_query, {'pkeys': pkeys})
+    names = {record['id']: record['full_name'] for record in await cursor.fetchall()}
+    return person_names_update(ES["index_name"], names)
+
+async def extract_genres_update(pg_conn: psycopg.AsyncConnection, film_work_ids: list[str]) -> PartialUpdate:
+    cursor = await pg_conn.execute(sql_extract_film_work_genres_query, {'film_work_ids': film_work_ids})
+    return genres_update(ES["index_name"], await cursor.fetchall())
+
+async def enrich_changed_movies(
+    pg_conn: psycopg.AsyncConnection,
+    batcher: AdaptiveBatcher,
+    enriched_films: EnrichedFilms,
+    input: asyncio.Queue,
+    output: asyncio.Queue
+) -> None:
+    while True:
+        scan, pkeys, checkpoint = await input.get()
+        if pkeys is None:
+            await output.put((scan, None, None))
+            continue
+        if scan.failed:
+            continue
+
+        changed_at = datetime.fromisoformat(checkpoint['updated_at'])
+        try:
+            if scan.table_name == 'film_work':
+                await enrich_film_works(pg_conn, scan, pkeys, changed_at, batcher, enriched_films, output)
+            elif scan.table_name == 'person' and ETL_PARTIAL_UPDATES:
+                await output.put((scan, await extract_person_names_update(pg_conn, pkeys), None))
+            else:
+                # Resolve the affected film works first, then aggregate them by their own ids
+                async with pg_conn.cursor(name=f'etl_resolve_{scan.table_name}') as cursor:
+                    cursor.itersize = ETL_CURSOR_ITERSIZE
+                    await cursor.execute(sql_extract_film_work_ids_queries[scan.table_name], {'pkeys': pkeys})
+                    while results := await fetch_page(cursor, page_size(batcher), 'resolve'):
+                        film_work_ids = [record['film_work_id'] for record in results]
+                        if ETL_PARTIAL_UPDATES:
+                            await output.put((scan, await extract_genres_update(pg_conn, film_work_ids), None))
+                        else:
+                            await enrich_film_works(pg_conn, scan, film_work_ids, changed_at, batcher, enriched_films, output)
+
+            await pg_conn.commit()
+            await output.put((scan, None, checkpoint))
+        except psycopg.OperationalError:
+            logger.error(f'[{scan.table_name}] Lost connection to Postgres while enriching, the scan is restarted on the next cycle')
+            scan.failed = True
+            await pg_conn.close()
+            pg_conn = await connect_to_pg()
+
+async def transform_movies(
+    transform: Callable[[dict], TransformedDocument],
+    input: asyncio.Queue,
+    output: asyncio.Queue
+) -> None:
+    while True:
+        scan, movie_dicts, checkpoint = await input.get()
+        if isinstance(movie_dicts, list):
+            with metrics.timer('etl_stage_seconds', stage='transform'):
+                movie_dicts = [transform(movie_dict) for movie_dict in movie_dicts]
+            metrics.inc('etl_rows_total', len(movie_dicts), stage='transform')
+        await output.put((scan, movie_dicts, checkpoint))
+
+async def load_movies(
+    state: State,
+    bulk_loader: AsyncBulkLoader,
+    hash_store: Optional[ContentHashStore],
+    input: asyncio.Queue
+) -> None:
+    while True:
+        scan, movies, checkpoint = await input.get()
+        if isinstance(movies, PartialUpdate):
+            if not scan.failed:
+                if movies.actions:
+                    await bulk_loader.submit(movies.actions)
+                if movies.update_by_query is not None:
+                    await bulk_loader.update_by_query(movies.update_by_query)
+            continue
+        if movies is not None:
+            if not scan.failed:
+                if hash_store is not None:
+                    # Filtered here and not in the transformer, so the pending hashes belong to the chunk being acknowledged
+                    movies = hash_store.filter(movies)
+                if movies:
+                    with metrics.timer('etl_stage_seconds', stage='load'):
+                        await bulk_loader.submit(make_index_actions(movies))
+                    metrics.inc('etl_rows_total', len(movies), stage='load')
+            continue
+
+        # Everything queued before the marker was submitted, wait until it is indexed
+        if not await bulk_loader.wait():
+            scan.failed = True
+
+        if hash_store is not None:
+            if scan.failed:
+                hash_store.rollback()
+            else:
+                hash_store.commit()
+
+        if checkpoint is None:
+            log_content_hash_counters(hash_store)
+            scan.done.set()
+        elif not scan.failed:
+            state.set_state(scan.table_name, checkpoint)
+            state.commit()
+            record_indexing_lag(scan.table_name, checkpoint)
+        else:
+            logger.error(f'[{scan.table_name}] Bulk loading failed, checkpoint is kept at {state.get_state(scan.table_name)}')
+
+async def run() -> None:
+    state = create_state()
+    batcher = create_batcher()
+    hash_store = create_content_hash_store()
+    clear_content_hashes_on_reset(state, hash_store)
+    es_conn = await connect_to_es(hash_store)
+    extract_conn = await connect_to_pg()
+    enrich_conn = await connect_to_pg()
+    bulk_loader = AsyncBulkLoader(es_conn, reconnect=partial(connect_to_es, hash_store), **bulk_loader_options(batcher, hash_store))
+    enriched_films = create_enriched_films()
+
+    pkeys_queue = asyncio.Queue(maxsize=ETL_ASYNC_QUEUE_SIZE)
+    rows_queue = asyncio.Queue(maxsize=ETL_ASYNC_QUEUE_SIZE)
+    documents_queue = asyncio.Queue(maxsize=ETL_ASYNC_QUEUE_SIZE)
+
+    start_metrics_exporter()
+    logger.info('Starting async ETL process for updates ...')
+    try:
+        await asyncio.gather(
+            extract_changed_movies(state, extract_conn, create_change_listener(), batcher, enriched_films, pkeys_queue),
+            enrich_changed_movies(enrich_conn, batcher, enriched_films, pkeys_queue, rows_queue),
+            transform_movies(TRANSFORM_ENGINES[ETL["transform_engine"]], rows_queue, documents_queue),
+            load_movies(state, bulk_loader, hash_store, documents_queue)
+        )
+    finally:
+        await bulk_loader.close()
+        state.commit(force=True)
@@ -0,0 +1,122 @@
+"""
+Fills the content schema with a synthetic, reproducible dataset for the
+pipeline benchmarks. The schema has to exist (Django migrations); the tables
+are truncated first.
+
+    python -m benchmarks.dataset --films 100000
+
+Every film gets 1-3 genres, 1-2 directors, 3-15 actors and 1-3 writers. The
+persons are drawn with a power-law skew, so a few of them appear in thousands
+of films like the popular actors of a real catalogue do, which is what makes
+the person -> film work fan-out expensive.
+"""
+import argparse
+import io
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+import psycopg2
+
+from config import DSL
+
+GENRES = (
+    'Action', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime', 'Documentary',
+    'Drama', 'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Musical', 'Mystery',
+    'News', 'Reality-TV', 'Romance', 'Sci-Fi', 'Short', 'Sport', 'Talk-Show',
+    'Thriller', 'War', 'Western', 'Боевик', 'Драма', 'Комедия', 'Мелодрама', 'Документальный'
+)
+ROLE_FAN_OUT = (('director', 1, 2), ('actor', 3, 15), ('writer', 1, 3))
+PERSONS_PER_FILM = 2
+CHUNK_FILMS = 10_000
+# Fixed, so two runs with the same seed produce the same rows
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TABLES = ('person_film_work', 'genre_film_work', 'film_work', 'person', 'genre')
+
+
+class Generator:
+    def __init__(self, films: int, seed: int) -> None:
+        self.films = films
+        self.persons = max(100, films * PERSONS_PER_FILM)
+        self.rnd = random.Random(seed)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+
+    def timestamp(self) -> str:
+        return (EPOCH + timedelta(seconds=self.rnd.randrange(365 * 24 * 3600))).isoformat()
+
+    def popular_person(self) -> int:
+        # Power-law skew: low indexes are picked far more often
+        return int(self.persons * self.rnd.random() ** 3)
+
+
+def copy_rows(cursor, table: str, columns: tuple, rows: list[tuple]) -> None:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join('\\N' if value is None else str(value) for value in row) + '\n')
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY content.{table} ({", ".join(columns)}) FROM STDIN', buffer)
+
+
+def generate(connection, films: int, seed: int) -> None:
+    gen = Generator(films, seed)
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {", ".join("content." + table for table in TABLES)}')
+
+        genre_ids = [gen.uuid() for _ in GENRES]
+        copy_rows(cursor, 'genre', ('id', 'name', 'description', 'created_at', 'updated_at'), [
+            (genre_id, name, None, gen.timestamp(), gen.timestamp()) for genre_id, name in zip(genre_ids, GENRES)
+        ])
+
+        person_ids = [gen.uuid() for _ in range(gen.persons)]
+        for start in range(0, gen.persons, CHUNK_FILMS):
+            copy_rows(cursor, 'person', ('id', 'full_name', 'created_at', 'updated_at'), [
+                (person_id, f'Person {start + n}', gen.timestamp(), gen.timestamp())
+                for n, person_id in enumerate(person_ids[start:start + CHUNK_FILMS])
+            ])
+
+        for start in range(0, films, CHUNK_FILMS):
+            film_rows, genre_rows, person_rows = [], [], []
+            for n in range(start, min(films, start + CHUNK_FILMS)):
+                film_id = gen.uuid()
+                created_at = gen.timestamp()
+                film_rows.append((
+                    film_id,
+                    f'Film {n}',
+                    f'Synthetic description of the film number {n}. ' * gen.rnd.randint(1, 8),
+                    None,
+                    None,
+                    round(gen.rnd.uniform(0, 10), 1),
+                    gen.rnd.choice(('movie', 'tv_show')),
+                    created_at,
+                    gen.timestamp()
+                ))
+                for genre_id in gen.rnd.sample(genre_ids, gen.rnd.randint(1, 3)):
+                    genre_rows.append((gen.uuid(), film_id, genre_id, created_at))
+                for role, low, high in ROLE_FAN_OUT:
+                    for person in {gen.popular_person() for _ in range(gen.rnd.randint(low, high))}:
+                        person_rows.append((gen.uuid(), film_id, person_ids[person], role, created_at))
+
+            copy_rows(cursor, 'film_work', (
+                'id', 'title', 'description', 'creation_date', 'file_path', 'rating', 'type', 'created_at', 'updated_at'
+            ), film_rows)
+            copy_rows(cursor, 'genre_film_work', ('id', 'film_work_id', 'genre_id', 'created_at'), genre_rows)
+            copy_rows(cursor, 'person_film_work', ('id', 'film_work_id', 'person_id', 'role', 'created_at'), person_rows)
+
+        cursor.execute(f'ANALYZE {", ".join("content." + table for table in TABLES)}')
+    connection.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--films', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    started_at = perf_counter()
+    with psycopg2.connect(**DSL) as connection:
+        generate(connection, args.films, args.seed)
+    connection.close()
+    print(f'Generated {args.films} films in {perf_counter() - started_at:.1f}s')
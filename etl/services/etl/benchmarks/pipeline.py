@@ -0,0 +1,281 @@
+"""
+Runs every stage of load_data.py on its own against the local Postgres (see
+benchmarks.dataset) and a stub bulk endpoint, and reports the throughput,
+the p50 / p99 batch latency and the peak RSS of each stage. Every stage runs
+in a fresh process, so the RSS of one doesn't leak into the next. The hot
+queries are also run as plain statements and as the prepared statements the
+ETL uses, to show the planning time saved.
+
+    python -m benchmarks.dataset --films 100000
+    python -m benchmarks.pipeline --output results.json
+    python -m benchmarks.pipeline --baseline results.json --tolerance 0.15
+
+With --baseline the run fails when a stage got slower than the tolerance allows.
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from statistics import median
+from time import perf_counter
+from typing import Callable, Iterator
+
+import psycopg2
+from psycopg2.extensions import AsIs
+from psycopg2.extras import DictCursor
+
+from elasticsearch import Elasticsearch
+
+from utils.bulk import BulkLoader
+from utils.sql_queries import (
+    sql_execute_enrich_query,
+    sql_execute_extract_query,
+    sql_extract_film_work_ids_range_query,
+    sql_extract_last_updated_table_query,
+    sql_extract_updated_film_work_records_query,
+    schema
+)
+from utils.transform import TRANSFORM_ENGINES
+
+from config import DSL, ES, ETL
+
+from load_data import (
+    ETL_BATCH_SIZE,
+    ETL_EXTRACT_PAGE_SIZE,
+    bulk_loader_options,
+    create_batcher,
+    make_index_actions,
+    open_named_cursor,
+    prepare_statements
+)
+
+from .stub_es import start_stub_es
+
+STAGES = ('extract', 'enrich', 'transform', 'load')
+PLANNING_REPEAT = 50
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def connect() -> psycopg2.extensions.connection:
+    connection = psycopg2.connect(**DSL, cursor_factory=DictCursor)
+    prepare_statements(connection)
+    connection.commit()
+    return connection
+
+
+def iter_film_work_ids(connection, page_size: int) -> Iterator[list[str]]:
+    with open_named_cursor(connection, 'benchmark_film_work') as cursor:
+        cursor.execute(sql_extract_film_work_ids_range_query, {'lower': ETL["default_state"]["id"], 'upper': None})
+        while results := list(islice(cursor, page_size)):
+            yield [record['id'] for record in results]
+
+
+def iter_film_rows(connection, page_size: int) -> Iterator[list[dict]]:
+    """Enriched film work rows, batch by batch, the input of the transform stage."""
+    for film_work_ids in iter_film_work_ids(connection, page_size):
+        with connection.cursor() as cursor:
+            cursor.execute(sql_extract_updated_film_work_records_query, {'film_work_ids': film_work_ids})
+            yield [dict(record) for record in cursor.fetchall()]
+
+
+def measure_batches(batches: Iterator, run_batch: Callable[[object], int]) -> tuple[int, float, list[float]]:
+    """Times run_batch on every batch, the time spent producing the batches is left out."""
+    items, total, latencies = 0, 0.0, []
+    for batch in batches:
+        started_at = perf_counter()
+        items += run_batch(batch)
+        latency = perf_counter() - started_at
+        total += latency
+        latencies.append(latency)
+    return items, total, latencies
+
+
+def bench_extract(connection, options: dict) -> tuple[int, float, list[float]]:
+    checkpoint = dict(ETL["default_state"])
+    extract_query = sql_execute_extract_query.format(table_name='film_work')
+    items, total, latencies = 0, 0.0, []
+    with connection.cursor() as cursor:
+        while True:
+            started_at = perf_counter()
+            cursor.execute(extract_query, {**checkpoint, 'limit': ETL_EXTRACT_PAGE_SIZE})
+            results = cursor.fetchall()
+            latency = perf_counter() - started_at
+            if not results:
+                break
+            checkpoint = {'updated_at': results[-1]['updated_at'], 'id': results[-1]['id']}
+            items += len(results)
+            total += latency
+            latencies.append(latency)
+    return items, total, latencies
+
+
+def bench_enrich(connection, options: dict) -> tuple[int, float, list[float]]:
+    def enrich(film_work_ids: list[str]) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(sql_execute_enrich_query, {'film_work_ids': film_work_ids})
+            return len(cursor.fetchall())
+
+    return measure_batches(iter_film_work_ids(connection, ETL_EXTRACT_PAGE_SIZE), enrich)
+
+
+def explain(cursor, query: str, query_vars: dict) -> tuple[float, float]:
+    """Planning time of the statement and the wall time of running it, in milliseconds."""
+    cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + query, query_vars)
+    planning_ms = cursor.fetchone()[0][0]['Planning Time']
+    started_at = perf_counter()
+    cursor.execute(query, query_vars)
+    cursor.fetchall()
+    return planning_ms, (perf_counter() - started_at) * 1000
+
+
+def bench_planning(repeat: int) -> list[dict]:
+    """The hot queries as plain statements vs the prepared statements of the ETL."""
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql_extract_film_work_ids_range_query, {'lower': ETL["default_state"]["id"], 'upper': None})
+            film_work_ids = [record['id'] for record in cursor.fetchmany(ETL_EXTRACT_PAGE_SIZE)]
+            checkpoint_vars = {**ETL["default_state"], 'limit': ETL_EXTRACT_PAGE_SIZE}
+            queries = {
+                'extract': (
+                    (sql_extract_last_updated_table_query, {**checkpoint_vars, 'table': AsIs(schema + '.film_work')}),
+                    (sql_execute_extract_query.format(table_name='film_work'), checkpoint_vars)
+                ),
+                'enrich': (
+                    (sql_extract_updated_film_work_records_query, {'film_work_ids': film_work_ids}),
+                    (sql_execute_enrich_query, {'film_work_ids': film_work_ids})
+                ),
+            }
+            results = []
+            for name, ((plain_query, plain_vars), (prepared_query, prepared_vars)) in queries.items():
+                # Postgres switches a prepared statement to its cached generic plan after 5 runs
+                plain = [explain(cursor, plain_query, plain_vars) for _ in range(repeat)]
+                prepared = [explain(cursor, prepared_query, prepared_vars) for _ in range(repeat)]
+                results.append({
+                    'query': name,
+                    'plain_planning_ms': median(planning for planning, _ in plain),
+                    'prepared_planning_ms': median(planning for planning, _ in prepared),
+                    'plain_wall_ms': median(wall for _, wall in plain),
+                    'prepared_wall_ms': median(wall for _, wall in prepared),
+                })
+            connection.rollback()
+    finally:
+        connection.close()
+    return results
+
+
+def bench_transform(connection, options: dict) -> tuple[int, float, list[float]]:
+    transform = TRANSFORM_ENGINES[options['engine']]
+    return measure_batches(
+        iter_film_rows(connection, ETL_BATCH_SIZE),
+        lambda rows: len([transform(row) for row in rows])
+    )
+
+
+def bench_load(connection, options: dict) -> tuple[int, float, list[float]]:
+    server = start_stub_es(options['bulk_delay'])
+    es_conn = Elasticsearch(f'http://127.0.0.1:{server.server_address[1]}')
+    bulk_loader = BulkLoader(es_conn, reconnect=lambda: es_conn, **bulk_loader_options(create_batcher()))
+    transform = TRANSFORM_ENGINES[options['engine']]
+
+    def load(movies: list) -> int:
+        bulk_loader.submit(make_index_actions(movies, ES["index_name"]))
+        return len(movies)
+
+    documents = ([transform(row) for row in rows] for rows in iter_film_rows(connection, ETL_BATCH_SIZE))
+    items, total, latencies = measure_batches(documents, load)
+    # Requests still in flight belong to the stage as well
+    started_at = perf_counter()
+    bulk_loader.close()
+    server.shutdown()
+    return items, total + perf_counter() - started_at, latencies
+
+
+BENCHMARKS = {
+    'extract': bench_extract,
+    'enrich': bench_enrich,
+    'transform': bench_transform,
+    'load': bench_load,
+}
+
+
+def run_stage(stage: str, options: dict) -> dict:
+    connection = connect()
+    try:
+        items, seconds, latencies = BENCHMARKS[stage](connection, options)
+    finally:
+        connection.close()
+    return {
+        'stage': stage,
+        'items': items,
+        'seconds': seconds,
+        'items_per_second': items / seconds if seconds else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def find_regressions(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    baseline_by_stage = {result['stage']: result for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline_by_stage.get(result['stage'])
+        if reference and result['items_per_second'] < reference['items_per_second'] * (1 - tolerance):
+            regressions.append(
+                f'{result["stage"]}: {result["items_per_second"]:,.0f}/s vs {reference["items_per_second"]:,.0f}/s'
+            )
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage', choices=STAGES, action='append', help='run only these stages')
+    parser.add_argument('--engine', choices=list(TRANSFORM_ENGINES), default=ETL["transform_engine"])
+    parser.add_argument('--bulk-delay', type=float, default=0.0, help='seconds the stub adds to every bulk response')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--planning-repeat', type=int, default=PLANNING_REPEAT)
+    args = parser.parse_args()
+
+    options = {'engine': args.engine, 'bulk_delay': args.bulk_delay}
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for stage in args.stage or STAGES:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            results.append(executor.submit(run_stage, stage, options).result())
+
+    print(f'{"stage":>10} {"items":>10} {"items/s":>12} {"p50 ms":>9} {"p99 ms":>9} {"RSS MB":>8}')
+    for result in results:
+        print(
+            f'{result["stage"]:>10} {result["items"]:>10} {result["items_per_second"]:>12,.0f} '
+            f'{result["p50_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["peak_rss_mb"]:>8.1f}'
+        )
+
+    planning = bench_planning(args.planning_repeat)
+    print(f'\n{"query":>10} {"plan ms":>9} {"prep plan ms":>13} {"wall ms":>9} {"prep wall ms":>13}')
+    for result in planning:
+        print(
+            f'{result["query"]:>10} {result["plain_planning_ms"]:>9.3f} {result["prepared_planning_ms"]:>13.3f} '
+            f'{result["plain_wall_ms"]:>9.3f} {result["prepared_wall_ms"]:>13.3f}'
+        )
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'stages': results, 'planning': planning}, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file)['stages'], args.tolerance)
+        if regressions:
+            raise SystemExit('Slower than the baseline:\n' + '\n'.join(regressions))
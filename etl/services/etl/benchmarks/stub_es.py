@@ -0,0 +1,71 @@
+"""
+A stand-in for the Elasticsearch bulk endpoint: acknowledges every item of a
+_bulk request without indexing anything, so the load stage can be measured
+without the cost of a real cluster. delay is added to every bulk response.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+
+import orjson
+
+INFO = {
+    'name': 'stub',
+    'cluster_name': 'benchmarks',
+    'version': {'number': '8.12.1', 'build_flavor': 'default'},
+    'tagline': 'You Know, for Search'
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+
+    def do_HEAD(self) -> None:
+        self._reply(None)
+
+    def do_GET(self) -> None:
+        self._reply(INFO)
+
+    def do_PUT(self) -> None:
+        # The client sends _bulk as PUT when no index is given in the path
+        self.do_POST()
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        if not self.path.split('?')[0].endswith('/_bulk'):
+            self._reply({'acknowledged': True})
+            return
+
+        lines = body.splitlines()
+        items = []
+        # Every action of the ETL (index / update) is followed by a source line
+        for action_line in lines[::2]:
+            ((action_type, meta),) = orjson.loads(action_line).items()
+            items.append({action_type: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 200}})
+        sleep(self.delay)
+        self._reply({'took': 0, 'errors': False, 'items': items})
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _reply(self, payload) -> None:
+        body = orjson.dumps(payload) if payload is not None else b''
+        self.send_response(200)
+        # elasticsearch-py refuses to talk to servers without this header
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+def start_stub_es(delay: float = 0.0) -> ThreadingHTTPServer:
+    handler = type('Handler', (StubHandler,), {'delay': delay})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
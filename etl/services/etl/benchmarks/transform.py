@@ -0,0 +1,76 @@
+"""
+Compares the pydantic and the fast transform engines on synthetic rows shaped
+like the result of sql_extract_updated_film_work_records_query.
+
+    python -m benchmarks.transform --films 20000
+"""
+import argparse
+import datetime
+import random
+import uuid
+from time import perf_counter
+
+from utils.models import PersonRolesEnum
+from utils.transform import TRANSFORM_ENGINES
+
+
+def generate_rows(films: int, persons_per_film: int = 12, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    roles = [role.value for role in PersonRolesEnum]
+    rows = []
+    for n in range(films):
+        rows.append({
+            'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+            'title': f'Фильм {n}',
+            'description': f'Description of the film number {n} ' * rnd.randint(0, 5) or None,
+            'creation_date': rnd.choice([None, datetime.date(1950, 1, 1) + datetime.timedelta(days=rnd.randint(0, 27_000))]),
+            'rating': rnd.choice([None, round(rnd.uniform(0, 10), 1)]),
+            'type': 'movie',
+            'created_at': None,
+            'updated_at': None,
+            'persons': [
+                {
+                    'person_role': rnd.choice(roles),
+                    'person_id': str(uuid.UUID(int=rnd.getrandbits(128))),
+                    'person_name': f'Person {rnd.randint(0, 10_000)}'
+                }
+                for _ in range(rnd.randint(0, persons_per_film))
+            ],
+            'genres': rnd.sample(['Action', 'Comedy', 'Drama', 'Sci-Fi', 'Документальный'], rnd.randint(1, 3)),
+        })
+    return rows
+
+
+def check_equivalence(rows: list[dict]) -> None:
+    for row in rows:
+        reference_id, reference = TRANSFORM_ENGINES['pydantic'](row)
+        fast_id, fast = TRANSFORM_ENGINES['fast'](row)
+        assert reference_id == fast_id, f'{reference_id} != {fast_id}'
+        assert reference.encode() == fast, f'Documents differ for {reference_id}'
+
+
+def measure(engine: str, rows: list[dict], repeat: int) -> float:
+    transform = TRANSFORM_ENGINES[engine]
+    best = float('inf')
+    for _ in range(repeat):
+        started_at = perf_counter()
+        for row in rows:
+            transform(row)
+        best = min(best, perf_counter() - started_at)
+    return len(rows) / best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--films', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.films)
+    check_equivalence(rows)
+    print(f'Equivalence: OK ({len(rows)} documents)')
+
+    results = {engine: measure(engine, rows, args.repeat) for engine in TRANSFORM_ENGINES}
+    for engine, docs_per_second in results.items():
+        print(f'{engine:>10}: {docs_per_second:>12,.0f} docs/s')
+    print(f'   speedup: {results["fast"] / results["pydantic"]:.1f}x')
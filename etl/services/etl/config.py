@@ -14,10 +14,33 @@ BACKOFF = {
 }
 
 ETL = {
+    "pipeline": os.environ.get("ETL_PIPELINE", "sync"),
+    "async_queue_size": os.environ.get("ETL_ASYNC_QUEUE_SIZE", 4),
     "sleep_time": os.environ.get("ETL_SLEEP_TIME", 1),
+    "change_capture": os.environ.get("ETL_CHANGE_CAPTURE", "poll"),
+    # Not configurable: the trigger of the backend migration 0005_etl_change_notify notifies this channel
+    "notify_channel": "etl_changes",
+    "notify_poll_interval": os.environ.get("ETL_NOTIFY_POLL_INTERVAL", 60),
+    "state_flush_interval": os.environ.get("ETL_STATE_FLUSH_INTERVAL", 5),
+    "extract_page_size": os.environ.get("ETL_EXTRACT_PAGE_SIZE", 100),
+    "batch_size": os.environ.get("ETL_BATCH_SIZE", 100),
+    "batch_min_size": os.environ.get("ETL_BATCH_MIN_SIZE", 10),
+    "batch_max_size": os.environ.get("ETL_BATCH_MAX_SIZE", 2000),
+    "batch_target_bytes": os.environ.get("ETL_BATCH_TARGET_BYTES", 5_000_000),
+    "batch_target_latency": os.environ.get("ETL_BATCH_TARGET_LATENCY", 1.0),
+    "cursor_itersize": os.environ.get("ETL_CURSOR_ITERSIZE", 1000),
+    "dedup_max_films": os.environ.get("ETL_DEDUP_MAX_FILMS", 100_000),
+    "transform_engine": os.environ.get("ETL_TRANSFORM_ENGINE", "pydantic"),
+    "partial_updates": os.environ.get("ETL_PARTIAL_UPDATES", False),
+    "content_hash_store": os.environ.get("ETL_CONTENT_HASH_STORE", "off"),
+    "content_hash_path": os.environ.get("ETL_CONTENT_HASH_PATH", "./state/content_hashes.sqlite3"),
+    "metrics": os.environ.get("ETL_METRICS", "off"),
+    "metrics_port": os.environ.get("ETL_METRICS_PORT", 9108),
+    "metrics_json_path": os.environ.get("ETL_METRICS_JSON_PATH", "./logs/etl_metrics.json"),
+    "metrics_dump_interval": os.environ.get("ETL_METRICS_DUMP_INTERVAL", 15),
     "extract_tables": ('film_work', 'person', 'genre'),
     "default_state": {
-        "id": "",
+        "id": "00000000-0000-0000-0000-000000000000",
         "updated_at": datetime.min
     }
 }
@@ -30,9 +53,31 @@ DSL = {
     "port": os.environ.get("DB_PORT"),
 }
 
+REDIS = {
+    "host": os.environ.get("REDIS_HOST", "127.0.0.1"),
+    "port": os.environ.get("REDIS_PORT", 6379),
+    "db": os.environ.get("REDIS_DB", 0),
+    "content_hash_key": os.environ.get("REDIS_CONTENT_HASH_KEY", "etl_content_hash"),
+}
+
+PG = {
+    "pool_size": os.environ.get("PG_POOL_SIZE", 2),
+    "connect_timeout": os.environ.get("PG_CONNECT_TIMEOUT", 5),
+    "statement_timeout": os.environ.get("PG_STATEMENT_TIMEOUT", 300_000),
+    "health_check_interval": os.environ.get("PG_HEALTH_CHECK_INTERVAL", 30),
+    "keepalives_idle": os.environ.get("PG_KEEPALIVES_IDLE", 10),
+}
+
 ES = {
     "hosts": f"http://{os.environ.get('ES_HOST', '127.0.0.1')}:{os.environ.get('ES_PORT', 9200)}",
     "index_name": "movies",
     "index_settings": index_settings,
-    "index_mappings": index_mappings 
+    "index_mappings": index_mappings,
+    "index_replicas": os.environ.get("ES_INDEX_REPLICAS", 1),
+    "bulk_max_in_flight": os.environ.get("ES_BULK_MAX_IN_FLIGHT", 1),
+    "bulk_max_bytes": os.environ.get("ES_BULK_MAX_BYTES", 10_000_000),
+    "bulk_max_retries": os.environ.get("ES_BULK_MAX_RETRIES", 5),
+    "bulk_dead_letter_path": os.environ.get("ES_BULK_DEAD_LETTER_PATH", "./state/dead_letter.ndjson"),
+    # Seconds, the renames of a popular person touch thousands of films
+    "update_by_query_timeout": os.environ.get("ES_UPDATE_BY_QUERY_TIMEOUT", 600),
 }
\ No newline at end of file
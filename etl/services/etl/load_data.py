@@ -1,30 +1,37 @@
-from time import sleep
 from datetime import datetime
+from functools import partial
+from itertools import islice
+from time import sleep
 
 import psycopg2
 from psycopg2.extras import DictCursor
-from psycopg2.extensions import AsIs
-
-from typing import Generator, Set
+from typing import Callable, Generator, Optional
 
 from elasticsearch import Elasticsearch
-import elasticsearch
+from redis import Redis
 
 from utils.backoff import backoff
-from utils.context_manager import closing
+from utils.batcher import AdaptiveBatcher
+from utils.bulk import BulkLoader
+from utils.change_listener import ChangeListener
+from utils.content_hash import ContentHashStore, RedisContentHashStore, SqliteContentHashStore
+from utils.dedup import EnrichedFilms
+from utils.pg_pool import PgPool
+from utils.partial_updates import PartialUpdate, genres_update, person_names_update
 from utils.sql_queries import (
-    sql_extract_last_updated_table_query, 
-    sql_extract_updated_film_work_records_query, 
-    schema
+    sql_execute_enrich_query,
+    sql_execute_extract_query,
+    sql_prepare_enrich_query,
+    sql_prepare_extract_query,
+    sql_extract_film_work_ids_queries,
+    sql_extract_film_work_genres_query,
+    sql_extract_person_names_query,
+    sql_transaction_started_at_query
 )
 from utils.coroutine import coroutine
 from utils.logger import logger
-from utils.models import (
-    Movie, 
-    TransformedMovie, 
-    PersonRolesEnum, 
-    filter_persons
-)
+from utils.metrics import metrics, start_http_exporter, start_json_exporter
+from utils.transform import TRANSFORM_ENGINES, TransformedDocument
 
 from state.json_file import JsonFileStorage
 from state.main import State
@@ -33,12 +40,11 @@ from config import (
     DSL,
     ES,
     ETL,
-    BACKOFF
+    BACKOFF,
+    PG,
+    REDIS
 )
 
-STATE_UPDATED_KEY = 'last_updated_record'
-
-
 """
 Source approach:
 https://habr.com/ru/articles/710106/
@@ -48,148 +54,378 @@ BACKOFF_START_SLEEP_TIME = int(BACKOFF["start_sleep_time"])
 BACKOFF_FACTOR = int(BACKOFF["factor"])
 BACKOFF_BORDER_SLEEP_TIME = int(BACKOFF["border_sleep_time"])
 
+STATE_FILE_PATH = './state/movies_state.json'
+
 ETL_SLEEP_TIME = int(ETL["sleep_time"])
+ETL_NOTIFY_POLL_INTERVAL = float(ETL["notify_poll_interval"])
+ETL_STATE_FLUSH_INTERVAL = float(ETL["state_flush_interval"])
+ETL_EXTRACT_PAGE_SIZE = int(ETL["extract_page_size"])
+ETL_BATCH_SIZE = int(ETL["batch_size"])
+ETL_BATCH_MIN_SIZE = int(ETL["batch_min_size"])
+ETL_BATCH_MAX_SIZE = int(ETL["batch_max_size"])
+ETL_BATCH_TARGET_BYTES = int(ETL["batch_target_bytes"])
+ETL_BATCH_TARGET_LATENCY = float(ETL["batch_target_latency"])
+ETL_CURSOR_ITERSIZE = int(ETL["cursor_itersize"])
+ETL_DEDUP_MAX_FILMS = int(ETL["dedup_max_films"])
+ETL_PARTIAL_UPDATES = ETL["partial_updates"] == 'True'
+
+PG_POOL_SIZE = int(PG["pool_size"])
+PG_CONNECT_TIMEOUT = int(PG["connect_timeout"])
+PG_STATEMENT_TIMEOUT = int(PG["statement_timeout"])
+PG_HEALTH_CHECK_INTERVAL = float(PG["health_check_interval"])
+PG_KEEPALIVES_IDLE = int(PG["keepalives_idle"])
+
+ES_BULK_MAX_IN_FLIGHT = int(ES["bulk_max_in_flight"])
+ES_BULK_MAX_BYTES = int(ES["bulk_max_bytes"])
+ES_BULK_MAX_RETRIES = int(ES["bulk_max_retries"])
+ES_UPDATE_BY_QUERY_TIMEOUT = float(ES["update_by_query_timeout"])
 
 @backoff(BACKOFF_START_SLEEP_TIME, BACKOFF_FACTOR, BACKOFF_BORDER_SLEEP_TIME)
 def connect_to_pg():
-    with closing(psycopg2.connect(**DSL, cursor_factory=DictCursor)) as pg_conn:
-        pg_conn = psycopg2.connect(**DSL, cursor_factory=DictCursor)
-        curs = pg_conn.cursor()
-        return curs
+    return psycopg2.connect(
+        **DSL,
+        cursor_factory=DictCursor,
+        connect_timeout=PG_CONNECT_TIMEOUT,
+        options=f'-c statement_timeout={PG_STATEMENT_TIMEOUT}',
+        # Notice a dead server (e.g. after a failover) in seconds, not after the OS TCP timeout
+        keepalives=1,
+        keepalives_idle=PG_KEEPALIVES_IDLE,
+        keepalives_interval=PG_KEEPALIVES_IDLE,
+        keepalives_count=3
+    )
 
 @backoff(BACKOFF_START_SLEEP_TIME, BACKOFF_FACTOR, BACKOFF_BORDER_SLEEP_TIME)
-def connect_to_es():
+def connect_to_es(hash_store: Optional[ContentHashStore] = None):
     es_conn = Elasticsearch(ES["hosts"])
     if not es_conn.indices.exists(index=ES["index_name"]):
         es_conn.indices.create(index=ES["index_name"], settings=ES["index_settings"], mappings=ES["index_mappings"])
+        if hash_store is not None:
+            # The stored hashes describe documents of an index that is gone
+            hash_store.clear()
+    else:
+        # The mapping is strict, fields added to it since the index was created must be put first
+        es_conn.indices.put_mapping(index=ES["index_name"], properties=ES["index_mappings"]["properties"])
     return es_conn
 
+def open_named_cursor(connection, name: str):
+    cursor = connection.cursor(name=name, cursor_factory=DictCursor)
+    cursor.itersize = ETL_CURSOR_ITERSIZE
+    return cursor
+
+def prepare_statements(connection) -> None:
+    # Session-level: the pool runs this for every new connection, reconnects included
+    with connection.cursor() as cursor:
+        for table_name in ETL["extract_tables"]:
+            cursor.execute(sql_prepare_extract_query.format(table_name=table_name))
+        cursor.execute(sql_prepare_enrich_query)
+
+def execute_page(cursor, query: str, query_vars: dict, stage: str) -> list:
+    with metrics.timer('etl_stage_seconds', stage=stage):
+        cursor.execute(query, query_vars)
+        results = cursor.fetchall()
+    metrics.inc('etl_rows_total', len(results), stage=stage)
+    return results
+
+def fetch_page(cursor, size: int, stage: str) -> list:
+    with metrics.timer('etl_stage_seconds', stage=stage):
+        results = list(islice(cursor, size))
+    metrics.inc('etl_rows_total', len(results), stage=stage)
+    return results
+
+def page_size(batcher: AdaptiveBatcher) -> int:
+    # Pages follow the batcher, otherwise the batches can't grow past a page
+    return max(ETL_EXTRACT_PAGE_SIZE, batcher.size)
+
+def record_indexing_lag(table_name: str, checkpoint: dict) -> None:
+    # Lag of the search index behind Postgres: now - the latest updated_at loaded
+    loaded_at = datetime.fromisoformat(checkpoint['updated_at'])
+    metrics.set('etl_last_loaded_updated_at_seconds', loaded_at.timestamp(), table=table_name)
+    metrics.set('etl_indexing_lag_seconds', (datetime.now(loaded_at.tzinfo) - loaded_at).total_seconds(), table=table_name)
+
 @coroutine
-def extract_changed_movies(state: State, cursor, next_node: Generator) -> Generator[None, tuple[str, list], None]:
+def extract_changed_movies(
+    state: State,
+    pool: PgPool,
+    batcher: AdaptiveBatcher,
+    next_node: Generator
+) -> Generator[None, tuple[str, dict], None]:
     while True:
-        table_name, last_updated_at = (yield)
-        pkeys = []
-        
-        logger.info(f'[{table_name}] Fetching data changed after: {last_updated_at}')
-        logger.info(f'[{table_name}] Fetching data updated after: {last_updated_at}\n')
-        
+        table_name, checkpoint = (yield)
+
+        logger.info(f'[{table_name}] Fetching data updated after: {checkpoint["updated_at"]} ({checkpoint["id"]})\n')
+
         try:
-            last_updated_vars = {
-                'table': AsIs(schema + '.' + table_name),
-                'updated_at': last_updated_at,
-                'limit': 100
-            }
+            with pool.connection() as connection:
+                pages = 0
+                with connection.cursor() as cursor:
+                    cursor.execute(sql_transaction_started_at_query)
+                    scan_started_at = cursor.fetchone()['started_at']
 
-            cursor.execute(sql_extract_last_updated_table_query, last_updated_vars)
-            while results := cursor.fetchmany(size=100):
-                last_updated_at = results[-1]['updated_at']
-                state.set_state(table_name, str(last_updated_at))
-                pkeys.extend([record[0] for record in results]) 
-                
-            if pkeys:
-                next_node.send((table_name, pkeys, cursor))
-            else:
-                logger.info(f"No pkeys found for table {table_name}. Skipping SQL query.\n")
-                
-        except psycopg2.OperationalError:
-            cursor = connect_to_pg()
+                # Keyset scan by (updated_at, id), a page per execution of the prepared statement,
+                # every page is forwarded downstream as soon as it arrives
+                extract_query = sql_execute_extract_query.format(table_name=table_name)
+                with connection.cursor() as extract_cursor:
+                    while results := execute_page(extract_cursor, extract_query, {**checkpoint, 'limit': page_size(batcher)}, 'extract'):
+                        checkpoint = {
+                            'updated_at': str(results[-1]['updated_at']),
+                            'id': str(results[-1]['id'])
+                        }
+                        next_node.send((table_name, [record['id'] for record in results], checkpoint, scan_started_at, connection))
+                        pages += 1
+                        if state.get_state(table_name) != checkpoint:
+                            # The chunk wasn't acknowledged downstream, retry it on the next cycle
+                            break
+
+                # Named cursors live until the end of the transaction
+                connection.commit()
+                if not pages:
+                    logger.info(f"No pkeys found for table {table_name}. Skipping SQL query.\n")
+                state.commit(force=True)
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The pool drops the broken connection and opens a new one for the next scan
+            logger.error(f'[{table_name}] Lost connection to Postgres, the scan is retried on the next cycle')
+
+def enrich_film_works(
+    connection,
+    film_work_ids: list[str],
+    changed_at: datetime,
+    scan_started_at: datetime,
+    batcher: AdaptiveBatcher,
+    enriched_films: EnrichedFilms,
+    next_node: Generator
+) -> None:
+    film_work_ids = enriched_films.filter(film_work_ids, changed_at)
+    if not film_work_ids:
+        return
+
+    with connection.cursor() as enrich_cursor:
+        results = execute_page(enrich_cursor, sql_execute_enrich_query, {'film_work_ids': film_work_ids}, 'enrich')
+    # One row per id, so the page is bounded by the number of ids asked for
+    while results:
+        next_node.send(results[:batcher.size])
+        results = results[batcher.size:]
+    enriched_films.add(film_work_ids, scan_started_at)
+
+def extract_person_names_update(connection, pkeys: list[str]) -> PartialUpdate:
+    with connection.cursor() as cursor:
+        cursor.execute(sql_extract_person_names_query, {'pkeys': list(pkeys)})
+        names = {record['id']: record['full_name'] for record in cursor.fetchall()}
+    return person_names_update(ES["index_name"], names)
+
+def extract_genres_update(connection, film_work_ids: list[str]) -> PartialUpdate:
+    with connection.cursor() as cursor:
+        cursor.execute(sql_extract_film_work_genres_query, {'film_work_ids': film_work_ids})
+        return genres_update(ES["index_name"], cursor.fetchall())
 
 @coroutine
-def enrich_changed_movies(state: State, next_node: Generator) -> Generator[None, any, None]:
+def enrich_changed_movies(
+    state: State,
+    bulk_loader: BulkLoader,
+    batcher: AdaptiveBatcher,
+    enriched_films: EnrichedFilms,
+    hash_store: Optional[ContentHashStore],
+    next_node: Generator
+) -> Generator[None, any, None]:
     while True:
-        table_name, pkeys, cursor = (yield)
+        table_name, pkeys, checkpoint, scan_started_at, connection = (yield)
+        changed_at = datetime.fromisoformat(checkpoint['updated_at'])
         try:
-            sql_extract_from_last_updated_table_vars = {
-                'table': AsIs(schema + '.' + table_name),
-                'pkeys': tuple(pkeys),
-                'last_id': state.get_state(STATE_UPDATED_KEY) or '',
-                'limit': 100
-            }
+            if table_name == 'film_work':
+                enrich_film_works(connection, pkeys, changed_at, scan_started_at, batcher, enriched_films, next_node)
+            elif table_name == 'person' and ETL_PARTIAL_UPDATES:
+                next_node.send(extract_person_names_update(connection, pkeys))
+            else:
+                # Resolve the affected film works first, then aggregate them by their own ids
+                with open_named_cursor(connection, f'etl_resolve_{table_name}') as resolve_cursor:
+                    resolve_cursor.execute(sql_extract_film_work_ids_queries[table_name], {'pkeys': list(pkeys)})
+                    while results := fetch_page(resolve_cursor, page_size(batcher), 'resolve'):
+                        film_work_ids = [record['film_work_id'] for record in results]
+                        if ETL_PARTIAL_UPDATES:
+                            next_node.send(extract_genres_update(connection, film_work_ids))
+                        else:
+                            enrich_film_works(connection, film_work_ids, changed_at, scan_started_at, batcher, enriched_films, next_node)
+
+            # The checkpoint moves only after the whole chunk was loaded downstream
+            if not bulk_loader.wait():
+                logger.error(f'[{table_name}] Bulk loading failed, checkpoint is kept at {state.get_state(table_name)}')
+                if hash_store is not None:
+                    hash_store.rollback()
+                continue
+            if hash_store is not None:
+                hash_store.commit()
+            state.set_state(table_name, checkpoint)
+            state.commit()
+            record_indexing_lag(table_name, checkpoint)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if hash_store is not None:
+                hash_store.rollback()
+            # The extractor stops on the unacknowledged chunk and reconnects
+            logger.error(f'[{table_name}] Lost connection to Postgres while enriching, checkpoint is kept at {checkpoint}')
 
-            cursor.execute(sql_extract_updated_film_work_records_query, sql_extract_from_last_updated_table_vars)
-            while results := cursor.fetchmany(size=100):
-                set_batch_state(
-                    state,
-                    table=table_name,
-                    pkeys=pkeys,
-                    last_updated_id=results[-1]['id']
-                )
-                next_node.send(results)
-            set_batch_state(
-                state,
-                table=None,
-                pkeys=None,
-                last_updated_id=None
-            )
-        except psycopg2.OperationalError:
-            cursor = connect_to_pg()
-            
-def set_batch_state(state: State, **kwargs) -> None:
-        for key, value in kwargs.items():
-            state.set_state(key=key, value=str(value))
-
-def get_last_updated_at(state, table_name) -> str:
-    last_updated_at = state.get_state(table_name)
-    return last_updated_at or datetime.min
+def get_checkpoint(state: State, table_name: str) -> dict:
+    checkpoint = state.get_state(table_name)
+    if isinstance(checkpoint, str):
+        # Older states kept only the updated_at value of the table
+        return {**ETL["default_state"], "updated_at": checkpoint}
+    return checkpoint or dict(ETL["default_state"])
 
 @coroutine
-def transform_movies(state: State, next_node: Generator) -> Generator[None, list[dict], None]:
+def transform_movies(transform: Callable[[dict], TransformedDocument], next_node: Generator) -> Generator[None, list[dict], None]:
     while movie_dicts := (yield):
-        batch = []
-        set_batch_state(state, data=movie_dicts)
-        for movie_dict in movie_dicts:
-            source_movie = Movie(**movie_dict)
-            directors = filter_persons(source_movie.persons, PersonRolesEnum.DIRECTOR)
-            actors = filter_persons(source_movie.persons, PersonRolesEnum.ACTOR)
-            writers = filter_persons(source_movie.persons, PersonRolesEnum.WRITER)
-            transformed_movie = TransformedMovie(
-                id=source_movie.id,
-                imdb_rating=source_movie.rating,
-                genres=source_movie.genres,
-                title=source_movie.title,
-                description=source_movie.description,
-                directors=[director for director in directors],
-                actors_names=[actor.full_name for actor in actors],
-                writers_names=[writer.full_name for writer in writers], 
-                actors=[actor for actor in actors],
-                writers=[writer for writer in writers]
-            )
-
-            batch.append(transformed_movie)
-        set_batch_state(state, data=None)
+        if isinstance(movie_dicts, PartialUpdate):
+            next_node.send(movie_dicts)
+            continue
+        with metrics.timer('etl_stage_seconds', stage='transform'):
+            batch = [transform(movie_dict) for movie_dict in movie_dicts]
+        metrics.inc('etl_rows_total', len(batch), stage='transform')
         next_node.send(batch)
 
 @coroutine
-def load_movies(es_conn: Elasticsearch) -> Generator[None, list[TransformedMovie], None]:
+def suppress_unchanged(hash_store: ContentHashStore, next_node: Generator) -> Generator[None, list[TransformedDocument], None]:
     while movies := (yield):
-        actions = []
-        for movie in movies:
-            action = {
-                "index": {
-                    "_index": ES["index_name"],
-                    "_id": movie.id
-                }
+        if isinstance(movies, PartialUpdate):
+            next_node.send(movies)
+            continue
+        if changed := hash_store.filter(movies):
+            next_node.send(changed)
+
+def make_index_actions(movies: list[TransformedDocument], index_name: str = ES["index_name"]) -> list[tuple[dict, str | bytes]]:
+    actions = []
+    for movie_id, source in movies:
+        action = {
+            "index": {
+                "_index": index_name,
+                "_id": movie_id
             }
-            actions.append(action)
-            actions.append(movie.model_dump_json())
-        
-        try:
-            es_conn.bulk(body=actions)
-        except elasticsearch.exceptions.ConnectionError:
-            es_conn = connect_to_es()
+        }
+        actions.append((action, source))
+    return actions
 
-if __name__ == "__main__":
-    es_conn = connect_to_es()
-    pg_curs = connect_to_pg()
-    state = State(JsonFileStorage('./state/movies_state.json'))
-    loader_coro = load_movies(es_conn)
-    transformer_coro = transform_movies(state, next_node=loader_coro)
-    enricher_coro = enrich_changed_movies(state, next_node=transformer_coro)
-    extractor_coro = extract_changed_movies(state, pg_curs, next_node=enricher_coro)
+def load_partial_update(bulk_loader: BulkLoader, update: PartialUpdate) -> None:
+    if update.actions:
+        bulk_loader.submit(update.actions)
+    if update.update_by_query is not None:
+        bulk_loader.update_by_query(update.update_by_query)
+
+@coroutine
+def load_movies(bulk_loader: BulkLoader, index_name: str = ES["index_name"]) -> Generator[None, list[TransformedDocument], None]:
+    while movies := (yield):
+        if isinstance(movies, PartialUpdate):
+            load_partial_update(bulk_loader, movies)
+            continue
+        with metrics.timer('etl_stage_seconds', stage='load'):
+            bulk_loader.submit(make_index_actions(movies, index_name))
+        metrics.inc('etl_rows_total', len(movies), stage='load')
+
+def start_metrics_exporter() -> None:
+    if ETL["metrics"] == "prometheus":
+        start_http_exporter(int(ETL["metrics_port"]))
+    elif ETL["metrics"] == "json":
+        start_json_exporter(ETL["metrics_json_path"], float(ETL["metrics_dump_interval"]))
+
+def create_pg_pool(prepare: Optional[Callable] = None) -> PgPool:
+    return PgPool(
+        connect=connect_to_pg,
+        max_size=PG_POOL_SIZE,
+        health_check_interval=PG_HEALTH_CHECK_INTERVAL,
+        prepare=prepare
+    )
+
+def create_state() -> State:
+    return State(JsonFileStorage(STATE_FILE_PATH), flush_interval=ETL_STATE_FLUSH_INTERVAL)
+
+def create_batcher() -> AdaptiveBatcher:
+    return AdaptiveBatcher(
+        initial_size=ETL_BATCH_SIZE,
+        min_size=ETL_BATCH_MIN_SIZE,
+        max_size=ETL_BATCH_MAX_SIZE,
+        target_bytes=ETL_BATCH_TARGET_BYTES,
+        target_latency=ETL_BATCH_TARGET_LATENCY
+    )
+
+def create_enriched_films() -> EnrichedFilms:
+    return EnrichedFilms(max_size=ETL_DEDUP_MAX_FILMS)
+
+def create_content_hash_store() -> Optional[ContentHashStore]:
+    if ETL["content_hash_store"] == "sqlite":
+        return SqliteContentHashStore(ETL["content_hash_path"])
+    if ETL["content_hash_store"] == "redis":
+        redis = Redis(host=REDIS["host"], port=int(REDIS["port"]), db=int(REDIS["db"]))
+        return RedisContentHashStore(redis, key=REDIS["content_hash_key"])
+    return None
+
+def clear_content_hashes_on_reset(state: State, hash_store: Optional[ContentHashStore]) -> None:
+    # Without checkpoints every film is loaded again, none of them may be suppressed
+    if hash_store is not None and not any(state.get_state(table_name) for table_name in ETL["extract_tables"]):
+        logger.info('The state is empty, clearing the content hashes')
+        hash_store.clear()
+
+def log_content_hash_counters(hash_store: Optional[ContentHashStore]) -> None:
+    if hash_store is not None:
+        logger.info(f'Unchanged documents suppressed: {hash_store.suppressed}, documents sent: {hash_store.sent}')
+
+def bulk_loader_options(batcher: AdaptiveBatcher, hash_store: Optional[ContentHashStore] = None) -> dict:
+    return {
+        "max_in_flight": ES_BULK_MAX_IN_FLIGHT,
+        "max_bytes": ES_BULK_MAX_BYTES,
+        "max_retries": ES_BULK_MAX_RETRIES,
+        "update_by_query_timeout": ES_UPDATE_BY_QUERY_TIMEOUT,
+        "backoff_policy": (BACKOFF_START_SLEEP_TIME, BACKOFF_FACTOR, BACKOFF_BORDER_SLEEP_TIME),
+        "dead_letter_path": ES["bulk_dead_letter_path"],
+        "batcher": batcher,
+        "on_dead_letter": hash_store.forget if hash_store is not None else None,
+    }
+
+def create_change_listener() -> Optional[ChangeListener]:
+    if ETL["change_capture"] != "notify":
+        return None
+    return ChangeListener(
+        connect=connect_to_pg,
+        channel=ETL["notify_channel"],
+        tables=ETL["extract_tables"]
+    )
+
+def run() -> None:
+    state = create_state()
+    hash_store = create_content_hash_store()
+    clear_content_hashes_on_reset(state, hash_store)
+    es_conn = connect_to_es(hash_store)
+    pg_pool = create_pg_pool(prepare=prepare_statements)
+    batcher = create_batcher()
+    bulk_loader = BulkLoader(es_conn, reconnect=partial(connect_to_es, hash_store), **bulk_loader_options(batcher, hash_store))
+    loader_coro = load_movies(bulk_loader)
+    if hash_store is not None:
+        loader_coro = suppress_unchanged(hash_store, next_node=loader_coro)
+    transformer_coro = transform_movies(TRANSFORM_ENGINES[ETL["transform_engine"]], next_node=loader_coro)
+    enriched_films = create_enriched_films()
+    enricher_coro = enrich_changed_movies(state, bulk_loader, batcher, enriched_films, hash_store, next_node=transformer_coro)
+    extractor_coro = extract_changed_movies(state, pg_pool, batcher, next_node=enricher_coro)
+    listener = create_change_listener()
+    start_metrics_exporter()
     logger.info('Starting ETL process for updates ...')
-    while True:
-        for table_name in ETL["extract_tables"]:
-            logger.info(f'[{table_name}] Checking updated records ...')
-            extractor_coro.send((table_name, get_last_updated_at(state, table_name)))
+    try:
+        tables = ETL["extract_tables"]
+        while True:
+            enriched_films.reset()
+            for table_name in tables:
+                logger.info(f'[{table_name}] Checking updated records ...')
+                extractor_coro.send((table_name, get_checkpoint(state, table_name)))
+
+                if listener is None:
+                    sleep(ETL_SLEEP_TIME)
+            log_content_hash_counters(hash_store)
+            if listener is not None:
+                tables = listener.wait(ETL_NOTIFY_POLL_INTERVAL)
+    finally:
+        bulk_loader.close()
+        pg_pool.close()
+        state.commit(force=True)
 
-            sleep(ETL_SLEEP_TIME)
\ No newline at end of file
+if __name__ == "__main__":
+    if ETL["pipeline"] == "async":
+        import asyncio
+        from async_load_data import run as run_async
+        asyncio.run(run_async())
+    else:
+        run()
\ No newline at end of file
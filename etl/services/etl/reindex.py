@@ -0,0 +1,276 @@
+import argparse
+import multiprocessing
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from itertools import islice
+from typing import Generator, Iterator, Optional
+
+from psycopg2.extensions import AsIs
+
+from elasticsearch import Elasticsearch
+
+from utils.backoff import backoff
+from utils.batcher import AdaptiveBatcher
+from utils.bulk import BulkLoader
+from utils.dedup import EnrichedFilms
+from utils.sql_queries import (
+    sql_extract_film_work_ids_range_query,
+    sql_extract_film_work_ids_queries,
+    sql_extract_last_updated_table_query,
+    sql_transaction_started_at_query,
+    schema
+)
+from utils.logger import logger
+from utils.transform import TRANSFORM_ENGINES
+
+from state.json_file import JsonFileStorage
+from state.main import State
+
+from config import ES, ETL
+
+from load_data import (
+    BACKOFF_START_SLEEP_TIME,
+    BACKOFF_FACTOR,
+    BACKOFF_BORDER_SLEEP_TIME,
+    bulk_loader_options,
+    connect_to_pg,
+    create_batcher,
+    enrich_film_works,
+    load_movies,
+    open_named_cursor,
+    page_size,
+    prepare_statements,
+    transform_movies
+)
+
+"""
+Full rebuild of the movies index without downtime:
+
+    python reindex.py [--workers N] [--shards M] [--delete-old]
+
+The documents are loaded into a new movies_v{N} index with refreshes and
+replicas turned off, then the index settings are restored, the index is
+force-merged and the movies alias is moved to it in a single request. The
+changes made while the index was being built are loaded again before and
+after the swap, so nothing written by the live ETL in the meantime is lost.
+
+The film works are split into id ranges (shards) loaded by a pool of worker
+processes, each with its own Postgres and ES connections. Finished shards are
+saved in REINDEX_STATE_FILE_PATH, an interrupted rebuild started again loads
+only the shards that weren't finished.
+"""
+
+INDEX_ALIAS = ES["index_name"]
+INDEX_VERSION_PATTERN = re.compile(rf'^{INDEX_ALIAS}_v(\d+)$')
+FORCE_MERGE_TIMEOUT = 3600
+REINDEX_STATE_FILE_PATH = './state/reindex_state.json'
+
+# Worker process globals, set up once per process by init_worker
+_worker: Optional[tuple] = None
+
+
+@backoff(BACKOFF_START_SLEEP_TIME, BACKOFF_FACTOR, BACKOFF_BORDER_SLEEP_TIME)
+def connect_to_cluster() -> Elasticsearch:
+    # Unlike connect_to_es, never creates the movies index: the name belongs to the alias
+    es_conn = Elasticsearch(ES["hosts"])
+    es_conn.info()
+    return es_conn
+
+def next_index_name(es_conn: Elasticsearch) -> str:
+    versions = [
+        int(match.group(1))
+        for index_name in es_conn.indices.get(index=f'{INDEX_ALIAS}_v*')
+        if (match := INDEX_VERSION_PATTERN.match(index_name))
+    ]
+    return f'{INDEX_ALIAS}_v{max(versions, default=0) + 1}'
+
+def create_bulk_index(es_conn: Elasticsearch, index_name: str) -> None:
+    settings = {**ES["index_settings"], "refresh_interval": "-1", "number_of_replicas": 0}
+    es_conn.indices.create(index=index_name, settings=settings, mappings=ES["index_mappings"])
+
+def get_started_at(connection) -> datetime:
+    with connection.cursor() as cursor:
+        cursor.execute(sql_transaction_started_at_query)
+        started_at = cursor.fetchone()['started_at']
+    connection.commit()
+    return started_at
+
+def make_shards(count: int) -> list[dict]:
+    # Even ranges of the uuid space, Postgres orders uuids the same way as their integer values
+    step = 2 ** 128 // count
+    bounds = [str(uuid.UUID(int=n * step)) for n in range(count)] + [None]
+    return [{'lower': bounds[n], 'upper': bounds[n + 1], 'done': False} for n in range(count)]
+
+def iter_film_work_ids(
+    connection,
+    batcher: AdaptiveBatcher,
+    changed_since: Optional[datetime],
+    shard: Optional[dict]
+) -> Iterator[list[str]]:
+    """The film work ids of the shard, or the ones affected by changes made since changed_since."""
+    if changed_since is None:
+        with open_named_cursor(connection, 'reindex_film_work') as cursor:
+            cursor.execute(sql_extract_film_work_ids_range_query, {'lower': shard['lower'], 'upper': shard['upper']})
+            while results := list(islice(cursor, page_size(batcher))):
+                yield [record['id'] for record in results]
+        return
+
+    for table_name in ETL["extract_tables"]:
+        with open_named_cursor(connection, f'reindex_changed_{table_name}') as cursor:
+            changed_vars = {
+                'table': AsIs(schema + '.' + table_name),
+                'updated_at': changed_since,
+                'id': ETL["default_state"]["id"],
+                'limit': None
+            }
+            cursor.execute(sql_extract_last_updated_table_query, changed_vars)
+            while results := list(islice(cursor, page_size(batcher))):
+                pkeys = [record['id'] for record in results]
+                if table_name == 'film_work':
+                    yield pkeys
+                    continue
+                with connection.cursor() as resolve_cursor:
+                    resolve_cursor.execute(sql_extract_film_work_ids_queries[table_name], {'pkeys': pkeys})
+                    yield [record['film_work_id'] for record in resolve_cursor.fetchall()]
+
+def load_index(
+    connection,
+    bulk_loader: BulkLoader,
+    next_node: Generator,
+    changed_since: Optional[datetime] = None,
+    shard: Optional[dict] = None
+) -> bool:
+    # Nothing is remembered, so every film is enriched and the change times don't matter
+    enriched_films = EnrichedFilms(max_size=0)
+    films = 0
+    for film_work_ids in iter_film_work_ids(connection, bulk_loader.batcher, changed_since, shard):
+        enrich_film_works(connection, film_work_ids, datetime.max, datetime.max, bulk_loader.batcher, enriched_films, next_node)
+        films += len(film_work_ids)
+    connection.commit()
+
+    logger.info(f'Loaded {films} film works, waiting for the bulk requests ...')
+    return bulk_loader.wait()
+
+def restore_index_settings(es_conn: Elasticsearch, index_name: str) -> None:
+    es_conn.indices.put_settings(index=index_name, settings={"refresh_interval": ES["index_settings"]["refresh_interval"]})
+    es_conn.indices.refresh(index=index_name)
+    # Merged before the replicas are added, so they copy the final segments
+    es_conn.options(request_timeout=FORCE_MERGE_TIMEOUT).indices.forcemerge(index=index_name, max_num_segments=1)
+    es_conn.indices.put_settings(index=index_name, settings={"number_of_replicas": int(ES["index_replicas"])})
+
+def swap_alias(es_conn: Elasticsearch, index_name: str) -> list[str]:
+    """Points the alias to index_name and returns the indices it pointed to before."""
+    actions = [{"add": {"index": index_name, "alias": INDEX_ALIAS}}]
+    old_indices = []
+    if es_conn.indices.exists_alias(name=INDEX_ALIAS):
+        old_indices = list(es_conn.indices.get_alias(name=INDEX_ALIAS))
+        actions = [{"remove": {"index": old_index, "alias": INDEX_ALIAS}} for old_index in old_indices] + actions
+    elif es_conn.indices.exists(index=INDEX_ALIAS):
+        # The index created by connect_to_es holds the name, it is dropped in the same request
+        logger.warning(f'Replacing the {INDEX_ALIAS} index with an alias, the index is deleted')
+        actions.insert(0, {"remove_index": {"index": INDEX_ALIAS}})
+
+    es_conn.indices.update_aliases(actions=actions)
+    return old_indices
+
+def create_loader(index_name: str) -> tuple:
+    es_conn = connect_to_cluster()
+    connection = connect_to_pg()
+    prepare_statements(connection)
+    connection.commit()
+    bulk_loader = BulkLoader(es_conn, reconnect=connect_to_cluster, **bulk_loader_options(create_batcher()))
+    loader_coro = load_movies(bulk_loader, index_name)
+    transformer_coro = transform_movies(TRANSFORM_ENGINES[ETL["transform_engine"]], next_node=loader_coro)
+    return connection, bulk_loader, transformer_coro
+
+def init_worker(index_name: str) -> None:
+    global _worker
+    _worker = create_loader(index_name)
+
+def load_shard(shard_no: int, shard: dict) -> tuple[int, bool]:
+    connection, bulk_loader, transformer_coro = _worker
+    return shard_no, load_index(connection, bulk_loader, transformer_coro, shard=shard)
+
+def load_shards(state: State, rebuild: dict, workers: int) -> bool:
+    shards = rebuild['shards']
+    pending = [shard_no for shard_no, shard in enumerate(shards) if not shard['done']]
+    logger.info(f'Loading {len(pending)} of {len(shards)} shards into {rebuild["index"]} with {workers} workers ...')
+
+    # Spawned, not forked: the workers open their own connections instead of sharing the coordinator's
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(rebuild['index'],)) as executor:
+        futures = [executor.submit(load_shard, shard_no, shards[shard_no]) for shard_no in pending]
+        for future in as_completed(futures):
+            try:
+                shard_no, succeeded = future.result()
+            except Exception as error:
+                logger.error(f'Reindex worker failed: {error}')
+                continue
+            if not succeeded:
+                logger.error(f'Bulk loading of shard {shard_no} failed')
+                continue
+            shards[shard_no]['done'] = True
+            state.set_state('rebuild', rebuild)
+            state.commit(force=True)
+
+    return all(shard['done'] for shard in shards)
+
+def run(workers: int, shards: int, delete_old: bool) -> None:
+    state = State(JsonFileStorage(REINDEX_STATE_FILE_PATH))
+    es_conn = connect_to_cluster()
+    rebuild = state.get_state('rebuild')
+    if rebuild is not None and es_conn.indices.exists(index=rebuild['index']):
+        logger.info(f'Resuming the rebuild of {rebuild["index"]} started at {rebuild["started_at"]}')
+    else:
+        index_name = next_index_name(es_conn)
+        create_bulk_index(es_conn, index_name)
+        connection = connect_to_pg()
+        rebuild = {
+            'index': index_name,
+            'started_at': str(get_started_at(connection)),
+            'shards': make_shards(shards)
+        }
+        connection.close()
+        state.set_state('rebuild', rebuild)
+        state.commit(force=True)
+
+    index_name = rebuild['index']
+    if not load_shards(state, rebuild, workers):
+        raise SystemExit(f'Some shards of {index_name} failed, run the reindex again to load them')
+
+    connection, bulk_loader, transformer_coro = create_loader(index_name)
+    try:
+        started_at = datetime.fromisoformat(rebuild['started_at'])
+        logger.info(f'Loading the changes made since {started_at} ...')
+        caught_up_at = get_started_at(connection)
+        if not load_index(connection, bulk_loader, transformer_coro, changed_since=started_at):
+            raise SystemExit(f'Bulk loading into {index_name} failed, the alias is not moved')
+
+        restore_index_settings(es_conn, index_name)
+        old_indices = swap_alias(es_conn, index_name)
+        logger.info(f'{INDEX_ALIAS} now points to {index_name}')
+        state.set_state('rebuild', None)
+        state.commit(force=True)
+
+        # The live ETL wrote to the old index until the swap
+        if not load_index(connection, bulk_loader, transformer_coro, changed_since=caught_up_at):
+            logger.error(f'Loading the changes made since {caught_up_at} failed, run the reindex again to pick them up')
+
+        if delete_old and old_indices:
+            es_conn.indices.delete(index=','.join(old_indices))
+            logger.info(f'Deleted {", ".join(old_indices)}')
+    finally:
+        bulk_loader.close()
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--shards', type=int, help='number of film work id ranges, 4 per worker by default')
+    parser.add_argument('--delete-old', action='store_true', help='delete the indices the alias pointed to before')
+    args = parser.parse_args()
+    run(args.workers, args.shards or args.workers * 4, args.delete_old)
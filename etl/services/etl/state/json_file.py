@@ -1,5 +1,7 @@
 from typing import Any, Dict
 import json
+import os
+import tempfile
 from .base import BaseStorage
 
 
@@ -8,8 +10,19 @@ class JsonFileStorage(BaseStorage):
         self.file_path = file_path
 
     def save_state(self, state: Dict[str, Any]) -> None:
-        with open(self.file_path, "w") as write_file:
-            json.dump(state, write_file)
+        # Write to a temp file in the same directory and rename it over the old one,
+        # so a crash mid-write never leaves a truncated state file
+        dir_name = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, "w") as write_file:
+                json.dump(state, write_file)
+                write_file.flush()
+                os.fsync(write_file.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
     def retrieve_state(self) -> Dict[str, Any]:
         try:
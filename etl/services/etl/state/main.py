@@ -1,16 +1,32 @@
 from .base import BaseStorage
+from time import monotonic
 from typing import Any
 
 class State:
     state = {}
 
-    def __init__(self, storage: BaseStorage) -> None:
+    def __init__(self, storage: BaseStorage, flush_interval: float = 0) -> None:
         self.storage = storage
         self.state = self.storage.retrieve_state()
+        self.flush_interval = flush_interval
+        self._dirty = False
+        self._last_flush = monotonic()
 
     def set_state(self, key: str, value: Any) -> None:
+        # Updates are buffered in memory and persisted only on commit()
         self.state[key] = value
-        self.storage.save_state(self.state)
+        self._dirty = True
 
     def get_state(self, key: str) -> Any:
-        return self.state.get(key)
\ No newline at end of file
+        return self.state.get(key)
+
+    def commit(self, force: bool = False) -> None:
+        # Called at batch commit points, i.e. after the batch was loaded into ES,
+        # so the persisted checkpoint never runs ahead of the indexed data
+        if not self._dirty:
+            return
+        if not force and monotonic() - self._last_flush < self.flush_interval:
+            return
+        self.storage.save_state(self.state)
+        self._dirty = False
+        self._last_flush = monotonic()
@@ -5,18 +5,21 @@ from .base import BaseStorage
 
 class RedisStorage(BaseStorage):
 
-    def __init__(self, redis: Redis):
+    def __init__(self, redis: Redis, key: str = 'data'):
         self._redis = redis
+        self._key = key
 
     def save_state(self, state: Dict[str, Any]) -> None:
-        r = self._redis
+        # The whole buffered state goes out in a single transactional round trip
         p_data = json.dumps(state)
-        r.set('data', p_data)
+        with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key, p_data)
+            pipe.execute()
 
     def retrieve_state(self) -> Dict[str, Any]:
         r = self._redis
-        p_data = r.get('data')
+        p_data = r.get(self._key)
         if (p_data is not None):
             data = json.loads(p_data)
             return data
-        return {}
\ No newline at end of file
+        return {}
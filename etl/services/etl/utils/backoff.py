@@ -1,25 +1,48 @@
 
+import asyncio
 from functools import wraps
 from time import sleep
+from typing import Iterator
 
 from .logger import logger
 
 
+def sleep_times(start_sleep_time=1, factor=2, border_sleep_time=10) -> Iterator[float]:
+    n = 0
+    while True:
+        yield min(start_sleep_time * (factor ** n), border_sleep_time)
+        n += 1
+
+
 def backoff(start_sleep_time=1, factor=2, border_sleep_time=10):
     def func_wrapper(func):
         @wraps(func)
         def inner(*args, **kwargs):
-            n = 1
-            t = start_sleep_time
+            delays = sleep_times(start_sleep_time, factor, border_sleep_time)
             while True:
                 try:
                     return func(*args, **kwargs)
                 except Exception:
-                    error_msg = f'Backoff exception in function: {func.__name__}\n Next try in {int(min(t, border_sleep_time))} seconds\n'
+                    t = next(delays)
+                    error_msg = f'Backoff exception in function: {func.__name__}\n Next try in {int(t)} seconds\n'
+                    logger.error(error_msg)
+                    sleep(t)
+        return inner
+    return func_wrapper
+
+
+def async_backoff(start_sleep_time=1, factor=2, border_sleep_time=10):
+    def func_wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            delays = sleep_times(start_sleep_time, factor, border_sleep_time)
+            while True:
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    t = next(delays)
+                    error_msg = f'Backoff exception in function: {func.__name__}\n Next try in {int(t)} seconds\n'
                     logger.error(error_msg)
-                    if (t < border_sleep_time):
-                        t = start_sleep_time * (factor ** n)
-                    n += 1
-                    sleep(min(t, border_sleep_time))
+                    await asyncio.sleep(t)
         return inner
     return func_wrapper
@@ -0,0 +1,43 @@
+from threading import Lock
+
+from .logger import logger
+
+
+class AdaptiveBatcher:
+    """
+    Picks the number of documents per batch from the measured bulk requests:
+    the size that hits target_bytes with the observed document size, shrunk
+    further when a request took longer than target_latency.
+    """
+
+    def __init__(
+        self,
+        initial_size: int,
+        min_size: int,
+        max_size: int,
+        target_bytes: int,
+        target_latency: float
+    ) -> None:
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_bytes = target_bytes
+        self.target_latency = target_latency
+        self.size = self._clamp(initial_size)
+        self._lock = Lock()
+
+    def record(self, docs: int, payload_bytes: int, latency: float) -> None:
+        if not docs or not payload_bytes:
+            return
+
+        with self._lock:
+            wanted = self.target_bytes * docs / payload_bytes
+            if latency > self.target_latency:
+                wanted = min(wanted, docs * self.target_latency / latency)
+            # Move halfway to the wanted size and at most double per step to damp the noise
+            new_size = self._clamp(min((self.size + wanted) / 2, self.size * 2))
+            if new_size != self.size:
+                logger.debug(f'Batch size {self.size} -> {new_size} ({payload_bytes} bytes in {latency:.3f}s)')
+            self.size = new_size
+
+    def _clamp(self, size: float) -> int:
+        return max(self.min_size, min(self.max_size, int(size)))
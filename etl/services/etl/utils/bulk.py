@@ -0,0 +1,332 @@
+import asyncio
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter, sleep
+from functools import partial
+from typing import Any, Awaitable, Callable, Generator, Iterator, List, Optional, Tuple, Union
+
+import elasticsearch
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+
+from .backoff import sleep_times
+from .batcher import AdaptiveBatcher
+from .logger import logger
+from .metrics import metrics
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+BulkItem = Tuple[bytes, bytes]
+
+# The I/O a step generator of BaseBulkLoader asks for: sleep for the given
+# seconds, call the given ES client method and send back its result (or
+# throw its error in), or replace the given connection by a new one
+SLEEP, CALL, RECONNECT = 'sleep', 'call', 'reconnect'
+Steps = Generator[Tuple[str, Any], Any, None]
+
+
+class BaseBulkLoader:
+    def __init__(
+        self,
+        es_conn,
+        reconnect: Callable,
+        max_in_flight: int = 1,
+        max_bytes: int = 10_000_000,
+        max_retries: int = 5,
+        backoff_policy: Tuple[float, float, float] = (1, 2, 10),
+        dead_letter_path: str = './state/dead_letter.ndjson',
+        batcher: Optional[AdaptiveBatcher] = None,
+        on_dead_letter: Optional[Callable[[List[str]], None]] = None,
+        update_by_query_timeout: float = 600
+    ) -> None:
+        self.es_conn = es_conn
+        self.max_in_flight = max_in_flight
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.backoff_policy = backoff_policy
+        self.dead_letter_path = dead_letter_path
+        self.batcher = batcher
+        self.on_dead_letter = on_dead_letter
+        self.update_by_query_timeout = update_by_query_timeout
+        self._reconnect = reconnect
+        self._dead_letter_lock = Lock()
+        self._failed = False
+
+    def _split(self, actions: List[Tuple[dict, Union[str, bytes]]]) -> Iterator[List[BulkItem]]:
+        items, size = [], 0
+        for action, source in actions:
+            if isinstance(source, str):
+                source = source.encode()
+            item = (f'{json.dumps(action)}\n'.encode(), source + b'\n')
+            item_size = len(item[0]) + len(item[1])
+            if items and size + item_size > self.max_bytes:
+                yield items
+                items, size = [], 0
+            items.append(item)
+            size += item_size
+
+        if items:
+            yield items
+
+    def _retry_items(self, items: List[BulkItem], response) -> List[BulkItem]:
+        """Dead-letters the items rejected for good and returns the ones worth a retry."""
+        if not response['errors']:
+            return []
+
+        retry = []
+        for item, result in zip(items, response['items']):
+            ((action_type, item_result),) = result.items()
+            if item_result['status'] < 300:
+                continue
+            if action_type == 'update' and item_result['status'] == 404:
+                # Partial update of a film that isn't indexed yet, its own change will index it
+                continue
+            if item_result['status'] in RETRY_STATUSES:
+                retry.append(item)
+            else:
+                self._dead_letter([item], item_result.get('error'))
+        return retry
+
+    def _record(self, items: List[BulkItem], payload: bytes, started_at: float) -> None:
+        latency = perf_counter() - started_at
+        metrics.inc('etl_bulk_requests_total')
+        metrics.inc('etl_bulk_bytes_total', len(payload))
+        metrics.observe('etl_bulk_request_seconds', latency)
+        if self.batcher is not None:
+            self.batcher.record(len(items), len(payload), latency)
+
+    def _dead_letter(self, items: List[BulkItem], error: Optional[object]) -> None:
+        logger.error(f'Moving {len(items)} bulk items to {self.dead_letter_path}: {error}')
+        metrics.inc('etl_dead_lettered_documents_total', len(items))
+        document_ids = []
+        with self._dead_letter_lock, open(self.dead_letter_path, 'a') as dead_letter_file:
+            for action, source in items:
+                record = {
+                    'action': json.loads(action),
+                    'source': json.loads(source),
+                    'error': error
+                }
+                dead_letter_file.write(json.dumps(record, default=str) + '\n')
+                (action_meta,) = record['action'].values()
+                document_ids.append(action_meta['_id'])
+
+        if self.on_dead_letter is not None:
+            self.on_dead_letter(document_ids)
+
+    def _send_steps(self, items: List[BulkItem]) -> Steps:
+        """The retry and dead-letter decisions of a bulk request, the I/O is run by _run() of the subclass."""
+        delays = sleep_times(*self.backoff_policy)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                t = next(delays)
+                logger.warning(f'Retrying {len(items)} rejected bulk items in {t} seconds')
+                metrics.inc('etl_bulk_retries_total', len(items))
+                yield SLEEP, t
+
+            es_conn = self.es_conn
+            payload = b''.join(action + source for action, source in items)
+            started_at = perf_counter()
+            try:
+                response = yield CALL, partial(es_conn.bulk, body=payload)
+            except elasticsearch.ApiError as error:
+                if error.status_code in RETRY_STATUSES:
+                    continue
+                self._dead_letter(items, str(error))
+                return
+            except elasticsearch.ConnectionTimeout:
+                # Not a ConnectionError, the connection itself is fine: the batch is
+                # left unacknowledged and sent again with the next cycle
+                logger.error('Bulk request to Elasticsearch timed out')
+                self._failed = True
+                return
+            except elasticsearch.TransportError:
+                logger.error('Lost connection to Elasticsearch while sending a bulk request')
+                self._failed = True
+                yield RECONNECT, es_conn
+                return
+
+            if not attempt:
+                self._record(items, payload, started_at)
+
+            items = self._retry_items(items, response)
+            if not items:
+                return
+
+        self._dead_letter(items, f'Rejected after {self.max_retries} retries')
+
+    def _update_by_query_steps(self, request: dict) -> Steps:
+        """
+        A failure keeps the current chunk unacknowledged. Version conflicts
+        don't abort the request: it is run again, and the script leaves the
+        documents it already updated alone.
+        """
+        delays = sleep_times(*self.backoff_policy)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                metrics.inc('etl_update_by_query_retries_total')
+                yield SLEEP, next(delays)
+
+            es_conn = self.es_conn
+            try:
+                # Make the documents indexed by previous chunks visible to the query
+                yield CALL, partial(es_conn.indices.refresh, index=request["index"])
+                with metrics.timer('etl_update_by_query_seconds'):
+                    response = yield CALL, partial(
+                        es_conn.options(request_timeout=self.update_by_query_timeout).update_by_query,
+                        conflicts='proceed',
+                        **request
+                    )
+                if response['failures']:
+                    logger.error(f'Update by query failed: {response["failures"][:3]}')
+                    break
+                if not response['version_conflicts']:
+                    return
+                logger.warning(f'Update by query ran into {response["version_conflicts"]} version conflicts')
+            except elasticsearch.ApiError as error:
+                if error.status_code in RETRY_STATUSES:
+                    continue
+                logger.error(f'Update by query failed: {error}')
+                break
+            except elasticsearch.ConnectionTimeout:
+                logger.error('Update by query timed out')
+                break
+            except elasticsearch.TransportError:
+                logger.error('Lost connection to Elasticsearch while running an update by query')
+                yield RECONNECT, es_conn
+                break
+
+        self._failed = True
+
+
+class BulkLoader(BaseBulkLoader):
+    """
+    Sends bulk requests to ES either inline (max_in_flight=1) or through a bounded
+    thread pool. submit() blocks while max_in_flight requests are pending, which is
+    the backpressure for the upstream coroutines; wait() is the barrier to call
+    before a checkpoint is moved.
+
+    Items rejected with a retryable status are re-sent with the backoff policy,
+    items that can't be indexed end up in the dead-letter file.
+    """
+
+    def __init__(self, es_conn: Elasticsearch, reconnect: Callable[[], Elasticsearch], **kwargs) -> None:
+        super().__init__(es_conn, reconnect, **kwargs)
+        self._reconnect_lock = Lock()
+        self._slots = BoundedSemaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight) if self.max_in_flight > 1 else None
+        self._futures: List[Future] = []
+
+    def submit(self, actions: List[Tuple[dict, Union[str, bytes]]]) -> None:
+        for items in self._split(actions):
+            if self._executor is None:
+                self._send(items)
+                continue
+
+            self._slots.acquire()
+            future = self._executor.submit(self._send, items)
+            future.add_done_callback(lambda _: self._slots.release())
+            self._futures.append(future)
+
+    def wait(self) -> bool:
+        """Waits for all pending requests and tells whether every item was acknowledged."""
+        for future in self._futures:
+            future.result()
+        self._futures.clear()
+
+        succeeded = not self._failed
+        self._failed = False
+        return succeeded
+
+    def close(self) -> None:
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _send(self, items: List[BulkItem]) -> None:
+        self._run(self._send_steps(items))
+
+    def update_by_query(self, request: dict) -> None:
+        """Runs an update-by-query request inline."""
+        self._run(self._update_by_query_steps(request))
+
+    def _run(self, steps: Steps) -> None:
+        result, error = None, None
+        while True:
+            try:
+                kind, arg = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration:
+                return
+            result, error = None, None
+            try:
+                if kind == SLEEP:
+                    sleep(arg)
+                elif kind == CALL:
+                    result = arg()
+                else:
+                    with self._reconnect_lock:
+                        if self.es_conn is arg:
+                            self.es_conn = self._reconnect()
+            except (elasticsearch.ApiError, elasticsearch.TransportError) as exc:
+                error = exc
+
+
+class AsyncBulkLoader(BaseBulkLoader):
+    """BulkLoader for the asyncio pipeline: requests run as tasks on the event loop."""
+
+    def __init__(
+        self,
+        es_conn: AsyncElasticsearch,
+        reconnect: Callable[[], Awaitable[AsyncElasticsearch]],
+        **kwargs
+    ) -> None:
+        super().__init__(es_conn, reconnect, **kwargs)
+        self._reconnect_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._tasks: List[asyncio.Task] = []
+
+    async def submit(self, actions: List[Tuple[dict, Union[str, bytes]]]) -> None:
+        for items in self._split(actions):
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(items))
+            task.add_done_callback(lambda _: self._slots.release())
+            self._tasks.append(task)
+
+    async def wait(self) -> bool:
+        """Waits for all pending requests and tells whether every item was acknowledged."""
+        await asyncio.gather(*self._tasks)
+        self._tasks.clear()
+
+        succeeded = not self._failed
+        self._failed = False
+        return succeeded
+
+    async def close(self) -> None:
+        await self.wait()
+        await self.es_conn.close()
+
+    async def _send(self, items: List[BulkItem]) -> None:
+        await self._run(self._send_steps(items))
+
+    async def update_by_query(self, request: dict) -> None:
+        """Runs an update-by-query request."""
+        await self._run(self._update_by_query_steps(request))
+
+    async def _run(self, steps: Steps) -> None:
+        result, error = None, None
+        while True:
+            try:
+                kind, arg = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration:
+                return
+            result, error = None, None
+            try:
+                if kind == SLEEP:
+                    await asyncio.sleep(arg)
+                elif kind == CALL:
+                    result = await arg()
+                else:
+                    async with self._reconnect_lock:
+                        if self.es_conn is arg:
+                            self.es_conn = await self._reconnect()
+            except (elasticsearch.ApiError, elasticsearch.TransportError) as exc:
+                error = exc
@@ -0,0 +1,46 @@
+import select
+from typing import Callable, Iterable, List
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, connection as _connection
+
+from .logger import logger
+
+
+class ChangeListener:
+    """
+    Waits for the pg_notify payloads sent by the triggers on the content tables
+    (see the movies 0005_etl_change_notify migration). The payload is the name
+    of the changed table. When nothing arrives within the timeout, or the
+    connection had to be restored, every table is returned so a regular poll
+    catches anything that was missed.
+    """
+
+    def __init__(self, connect: Callable[[], _connection], channel: str, tables: Iterable[str]) -> None:
+        self.channel = channel
+        self.tables = tuple(tables)
+        self._connect = connect
+        self._conn = self._listen()
+
+    def wait(self, timeout: float) -> List[str]:
+        try:
+            if not self._conn.notifies and select.select([self._conn], [], [], timeout) == ([], [], []):
+                return list(self.tables)
+
+            self._conn.poll()
+            changed = {notify.payload for notify in self._conn.notifies}
+            self._conn.notifies.clear()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            logger.error(f'Lost the LISTEN {self.channel} connection, falling back to a full poll')
+            self._conn.close()
+            self._conn = self._listen()
+            return list(self.tables)
+
+        return [table_name for table_name in self.tables if table_name in changed]
+
+    def _listen(self) -> _connection:
+        conn = self._connect()
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel};')
+        return conn
@@ -0,0 +1,120 @@
+import abc
+import sqlite3
+from hashlib import blake2b
+from threading import Lock
+from typing import Dict, Iterable, List
+
+from redis import Redis
+
+from .metrics import metrics
+from .transform import TransformedDocument
+
+
+def content_hash(source) -> bytes:
+    if isinstance(source, str):
+        source = source.encode()
+    return blake2b(source, digest_size=16).digest()
+
+
+class ContentHashStore(abc.ABC):
+    """
+    Remembers the hash of the last document acknowledged by ES for every film,
+    so documents that didn't change since (e.g. an updated_at bump from the
+    admin) are not sent again. Hashes of the sent documents stay pending until
+    commit(), which is called once the bulk loader acknowledged them; forget()
+    drops pending hashes of documents that ended up in the dead-letter file.
+    """
+
+    def __init__(self) -> None:
+        self.suppressed = 0
+        self.sent = 0
+        self._pending: Dict[str, bytes] = {}
+        self._lock = Lock()
+
+    def filter(self, movies: List[TransformedDocument]) -> List[TransformedDocument]:
+        if not movies:
+            return []
+        hashes = {movie_id: content_hash(source) for movie_id, source in movies}
+        stored = self._load(list(hashes))
+
+        changed = []
+        with self._lock:
+            for movie_id, source in movies:
+                # A document still in flight is what ES will hold, compare with it first
+                if self._pending.get(movie_id, stored.get(movie_id)) == hashes[movie_id]:
+                    self.suppressed += 1
+                    continue
+                self._pending[movie_id] = hashes[movie_id]
+                changed.append((movie_id, source))
+        self.sent += len(changed)
+        metrics.inc('etl_suppressed_documents_total', len(movies) - len(changed))
+        return changed
+
+    def forget(self, movie_ids: Iterable[str]) -> None:
+        with self._lock:
+            for movie_id in movie_ids:
+                self._pending.pop(movie_id, None)
+
+    def commit(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self._save(pending)
+
+    def rollback(self) -> None:
+        with self._lock:
+            self._pending.clear()
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _load(self, movie_ids: List[str]) -> Dict[str, bytes]:
+        pass
+
+    @abc.abstractmethod
+    def _save(self, hashes: Dict[str, bytes]) -> None:
+        pass
+
+
+class SqliteContentHashStore(ContentHashStore):
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS content_hash (id TEXT PRIMARY KEY, hash BLOB NOT NULL)')
+
+    def clear(self) -> None:
+        with self._conn:
+            self._conn.execute('DELETE FROM content_hash')
+
+    def _load(self, movie_ids: List[str]) -> Dict[str, bytes]:
+        placeholders = ', '.join('?' * len(movie_ids))
+        rows = self._conn.execute(f'SELECT id, hash FROM content_hash WHERE id IN ({placeholders})', movie_ids)
+        return dict(rows)
+
+    def _save(self, hashes: Dict[str, bytes]) -> None:
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO content_hash (id, hash) VALUES (?, ?)', hashes.items())
+
+
+class RedisContentHashStore(ContentHashStore):
+    def __init__(self, redis: Redis, key: str = 'content_hash') -> None:
+        super().__init__()
+        self._redis = redis
+        self._key = key
+
+    def clear(self) -> None:
+        self._redis.delete(self._key)
+
+    def _load(self, movie_ids: List[str]) -> Dict[str, bytes]:
+        return {
+            movie_id: stored_hash
+            for movie_id, stored_hash in zip(movie_ids, self._redis.hmget(self._key, movie_ids))
+            if stored_hash is not None
+        }
+
+    def _save(self, hashes: Dict[str, bytes]) -> None:
+        self._redis.hset(self._key, mapping=hashes)
+
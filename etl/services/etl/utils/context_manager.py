@@ -1,9 +0,0 @@
-from contextlib import contextmanager
-
-
-@contextmanager
-def closing(conn):
-    try:
-        yield conn
-    finally:
-        conn.close()
\ No newline at end of file
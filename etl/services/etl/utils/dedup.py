@@ -0,0 +1,29 @@
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+
+class EnrichedFilms:
+    """
+    Film works enriched during the current ETL cycle, with the start of the scan
+    that enriched them. A film whose change is older than that scan already has
+    the change in its document, so it is not aggregated again. Once max_size
+    films are remembered new ones are not tracked until reset().
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._films: Dict[str, datetime] = {}
+
+    def reset(self) -> None:
+        self._films.clear()
+
+    def filter(self, film_work_ids: Iterable[str], changed_at: datetime) -> List[str]:
+        return [
+            film_work_id for film_work_id in film_work_ids
+            if film_work_id not in self._films or self._films[film_work_id] <= changed_at
+        ]
+
+    def add(self, film_work_ids: Iterable[str], scan_started_at: datetime) -> None:
+        for film_work_id in film_work_ids:
+            if film_work_id in self._films or len(self._films) < self.max_size:
+                self._films[film_work_id] = scan_started_at
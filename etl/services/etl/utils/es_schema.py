@@ -64,6 +64,12 @@ index_mappings = {
         "type": "text",
         "analyzer": "ru_en"
       },
+      "creation_date": {
+        "type": "date"
+      },
+      "type": {
+        "type": "keyword"
+      },
       "directors": {
         "type": "nested",
         "properties": {
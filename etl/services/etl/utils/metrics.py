@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter, time
+from typing import Dict, Iterator, Tuple
+
+from .logger import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], **extra) -> str:
+    pairs = list(labels) + [(label, str(value)) for label, value in extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in pairs) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield str(bound), total
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms of the ETL process, labelled by
+    stage / table. Rendered in the Prometheus text format or as a JSON dict.
+    """
+
+    def __init__(self) -> None:
+        self.started_at = monotonic()
+        self._counters: Dict[MetricKey, float] = {}
+        self._gauges: Dict[MetricKey, float] = {}
+        self._histograms: Dict[MetricKey, Histogram] = {}
+        self._lock = Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - started_at, **labels)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        typed = set()
+
+        def add_type(name: str, metric_type: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {metric_type}')
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                add_type(name, 'counter')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+            for (name, labels), value in sorted(self._gauges.items()):
+                add_type(name, 'gauge')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                add_type(name, 'histogram')
+                for bound, count in histogram.cumulative():
+                    lines.append(f'{name}_bucket{_format_labels(labels, le=bound)} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        uptime = monotonic() - self.started_at
+        with self._lock:
+            return {
+                'timestamp': time(),
+                'uptime_seconds': uptime,
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value, 'per_second': value / uptime}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                'gauges': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._gauges.items())
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(labels),
+                        'buckets': dict(histogram.cumulative()),
+                        'sum': histogram.sum,
+                        'count': histogram.count
+                    }
+                    for (name, labels), histogram in sorted(self._histograms.items())
+                ],
+            }
+
+
+metrics = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def start_http_exporter(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('', port), _MetricsHandler)
+    Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f'Serving metrics on :{port}/metrics')
+    return server
+
+
+def start_json_exporter(path: str, interval: float) -> Event:
+    """Dumps the snapshot to path every interval seconds until the returned event is set."""
+    stopped = Event()
+
+    def dump() -> None:
+        while not stopped.wait(interval):
+            dir_name = os.path.dirname(os.path.abspath(path))
+            fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+            with os.fdopen(fd, 'w') as dump_file:
+                json.dump(metrics.snapshot(), dump_file)
+            os.replace(tmp_path, path)
+
+    Thread(target=dump, name='metrics-json', daemon=True).start()
+    logger.info(f'Dumping metrics to {path} every {interval} seconds')
+    return stopped
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 from typing import List, Optional
 import uuid
@@ -19,6 +19,7 @@ class Movie(BaseModel):
     id: str
     title: Optional[str] = None
     description: Optional[str] = None
+    creation_date: Optional[date] = None
     rating: Optional[float] = None
     type: Optional[str] = None
     created_at: Optional[datetime] = None
@@ -36,6 +37,8 @@ class TransformedMovie(BaseModel):
     genres: List[str]
     title: str
     description: Optional[str]
+    creation_date: Optional[date]
+    type: Optional[str]
     directors: Optional[List[TransformedPerson]]
     actors_names: Optional[List[str]]
     writers_names: Optional[List[str]]
@@ -0,0 +1,80 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+PERSON_ROLE_FIELDS = ('directors', 'actors', 'writers')
+
+# Renames the persons found in params.names and rebuilds the *_names fields from the nested lists.
+# Films already renamed are a noop, so a re-run after version conflicts only writes the conflicted ones.
+RENAME_PERSONS_SCRIPT = """
+    def names = params.names;
+    def renamed = false;
+    for (def role : ['directors', 'actors', 'writers']) {
+        def persons = ctx._source[role];
+        if (persons == null) {
+            continue;
+        }
+        for (def person : persons) {
+            if (names.containsKey(person.id) && person.full_name != names[person.id]) {
+                person.full_name = names[person.id];
+                renamed = true;
+            }
+        }
+    }
+    if (!renamed) {
+        ctx.op = 'noop';
+        return;
+    }
+    for (def role : ['actors', 'writers']) {
+        def persons = ctx._source[role];
+        if (persons == null) {
+            continue;
+        }
+        def person_names = [];
+        for (def person : persons) {
+            person_names.add(person.full_name);
+        }
+        ctx._source[role + '_names'] = person_names;
+    }
+"""
+
+
+@dataclass
+class PartialUpdate:
+    """
+    Travels through the pipeline instead of a batch of film work rows: the
+    transformer passes it as is and the loader sends the bulk update actions
+    and/or the update-by-query request.
+    """
+    actions: List[Tuple[dict, bytes]] = field(default_factory=list)
+    update_by_query: Optional[dict] = None
+
+
+def person_names_update(index_name: str, names: Dict[str, str]) -> PartialUpdate:
+    query = {
+        "bool": {
+            "should": [
+                {"nested": {"path": role_field, "query": {"terms": {f"{role_field}.id": list(names)}}}}
+                for role_field in PERSON_ROLE_FIELDS
+            ],
+            "minimum_should_match": 1
+        }
+    }
+    script = {
+        "source": RENAME_PERSONS_SCRIPT,
+        "lang": "painless",
+        "params": {"names": names}
+    }
+    return PartialUpdate(update_by_query={"index": index_name, "query": query, "script": script})
+
+
+def genres_update(index_name: str, film_work_genres: List[dict]) -> PartialUpdate:
+    actions = [
+        (
+            {"update": {"_index": index_name, "_id": record['id']}},
+            orjson.dumps({"doc": {"genres": record['genres']}})
+        )
+        for record in film_work_genres
+    ]
+    return PartialUpdate(actions=actions)
@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+from threading import Condition
+from time import monotonic
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as _connection
+
+from .logger import logger
+
+
+class PgPool:
+    """
+    A small pool of psycopg2 connections for the ETL. A connection idle for
+    longer than health_check_interval is pinged before it is handed out, a
+    connection that raised OperationalError / InterfaceError is closed instead
+    of going back to the pool, and every new connection goes through prepare()
+    so session state (prepared statements and the like) is restored after a
+    reconnect.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], _connection],
+        max_size: int = 2,
+        health_check_interval: float = 30,
+        prepare: Optional[Callable[[_connection], None]] = None
+    ) -> None:
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self._connect = connect
+        self._prepare = prepare
+        self._idle: List[Tuple[_connection, float]] = []
+        self._size = 0
+        self._available = Condition()
+
+    @contextmanager
+    def connection(self) -> Iterator[_connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._discard(conn)
+            raise
+        except BaseException:
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def close(self) -> None:
+        with self._available:
+            for conn, _ in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle.clear()
+
+    def _acquire(self) -> _connection:
+        with self._available:
+            while not self._idle and self._size >= self.max_size:
+                self._available.wait()
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+                self._size += 1
+
+        try:
+            if conn is not None and not self._is_alive(conn, released_at):
+                conn.close()
+                conn = None
+            if conn is None:
+                conn = self._open()
+        except BaseException:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+        return conn
+
+    def _open(self) -> _connection:
+        conn = self._connect()
+        if self._prepare is not None:
+            self._prepare(conn)
+            conn.commit()
+        return conn
+
+    def _is_alive(self, conn: _connection, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if monotonic() - released_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            logger.warning('Dropping a dead Postgres connection from the pool')
+            return False
+
+    def _release(self, conn: _connection) -> None:
+        try:
+            if not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                # Don't hand out a connection in the middle of somebody else's transaction
+                conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pass
+        if conn.closed:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.append((conn, monotonic()))
+            self._available.notify()
+
+    def _discard(self, conn: _connection) -> None:
+        conn.close()
+        with self._available:
+            self._size -= 1
+            self._available.notify()
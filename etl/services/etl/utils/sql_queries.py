@@ -5,6 +5,7 @@ sql_extract_updated_film_work_records_query = """
         film_work.id,
         film_work.title,
         film_work.description ,
+        film_work.creation_date,
         film_work.rating,
         film_work.type,
         film_work.created_at,
@@ -25,16 +26,67 @@ sql_extract_updated_film_work_records_query = """
         LEFT JOIN content.person ON person.id = pfw.person_id
         LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = film_work.id
         LEFT JOIN content.genre  ON genre.id = gfw.genre_id
-    WHERE %(table)s.id in %(pkeys)s
-    AND film_work.id::text > %(last_id)s
+    WHERE film_work.id = ANY(%(film_work_ids)s::uuid[])
     GROUP BY film_work.id
-    ORDER BY film_work.id
-    LIMIT %(limit)s;
+    ORDER BY film_work.id;
 """
 
+# Film works of a reindex shard, upper is None for the last shard
+sql_extract_film_work_ids_range_query = """
+    SELECT id FROM content.film_work
+    WHERE id >= %(lower)s::uuid AND (%(upper)s::uuid IS NULL OR id < %(upper)s::uuid)
+    ORDER BY id
+"""
+
+# Reverse dependencies: the film works affected by changed persons / genres
+sql_extract_film_work_ids_queries = {
+    'person': """
+        SELECT DISTINCT film_work_id FROM content.person_film_work
+        WHERE person_id = ANY(%(pkeys)s::uuid[])
+    """,
+    'genre': """
+        SELECT DISTINCT film_work_id FROM content.genre_film_work
+        WHERE genre_id = ANY(%(pkeys)s::uuid[])
+    """,
+}
+
+# Partial updates: only the fields touched by a person / genre change
+sql_extract_person_names_query = """
+    SELECT id, full_name FROM content.person
+    WHERE id = ANY(%(pkeys)s::uuid[])
+"""
+
+sql_extract_film_work_genres_query = """
+    SELECT film_work.id, array_agg(DISTINCT genre.name) as genres
+    FROM content.film_work
+        LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = film_work.id
+        LEFT JOIN content.genre ON genre.id = gfw.genre_id
+    WHERE film_work.id = ANY(%(film_work_ids)s::uuid[])
+    GROUP BY film_work.id
+"""
+
+sql_transaction_started_at_query = "SELECT now() AS started_at"
+
 sql_extract_last_updated_table_query = """
     SELECT id, updated_at FROM %(table)s
-    WHERE updated_at > %(updated_at)s
-    ORDER BY updated_at
+    WHERE (updated_at, id) > (%(updated_at)s, %(id)s::uuid)
+    ORDER BY updated_at, id
     LIMIT %(limit)s
-"""
\ No newline at end of file
+"""
+# Server-side prepared versions of the hot queries, created once per connection
+# by load_data.prepare_statements and executed with the values only
+sql_prepare_extract_query = """
+    PREPARE etl_extract_{table_name} (timestamptz, uuid, int) AS
+    SELECT id, updated_at FROM content.{table_name}
+    WHERE (updated_at, id) > ($1, $2)
+    ORDER BY updated_at, id
+    LIMIT $3
+"""
+
+sql_execute_extract_query = "EXECUTE etl_extract_{table_name} (%(updated_at)s, %(id)s, %(limit)s)"
+
+sql_prepare_enrich_query = "PREPARE etl_enrich_film_work (uuid[]) AS " + (
+    sql_extract_updated_film_work_records_query.replace('%(film_work_ids)s::uuid[]', '$1').strip().rstrip(';')
+)
+
+sql_execute_enrich_query = "EXECUTE etl_enrich_film_work (%(film_work_ids)s::uuid[])"
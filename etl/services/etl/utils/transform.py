@@ -0,0 +1,73 @@
+from typing import Callable, Dict, List, Tuple, Union
+
+import orjson
+
+from .models import (
+    Movie,
+    TransformedMovie,
+    PersonRolesEnum,
+    filter_persons
+)
+
+TransformedDocument = Tuple[str, Union[str, bytes]]
+
+ROLE_KEYS = {
+    PersonRolesEnum.DIRECTOR.value: 'directors',
+    PersonRolesEnum.ACTOR.value: 'actors',
+    PersonRolesEnum.WRITER.value: 'writers',
+}
+
+
+def pydantic_transform_movie(movie_dict: dict) -> TransformedDocument:
+    source_movie = Movie(**movie_dict)
+    directors = filter_persons(source_movie.persons, PersonRolesEnum.DIRECTOR)
+    actors = filter_persons(source_movie.persons, PersonRolesEnum.ACTOR)
+    writers = filter_persons(source_movie.persons, PersonRolesEnum.WRITER)
+    transformed_movie = TransformedMovie(
+        id=source_movie.id,
+        imdb_rating=source_movie.rating,
+        genres=source_movie.genres,
+        title=source_movie.title,
+        description=source_movie.description,
+        creation_date=source_movie.creation_date,
+        type=source_movie.type,
+        directors=[director for director in directors],
+        actors_names=[actor.full_name for actor in actors],
+        writers_names=[writer.full_name for writer in writers],
+        actors=[actor for actor in actors],
+        writers=[writer for writer in writers]
+    )
+    return transformed_movie.id, transformed_movie.model_dump_json()
+
+
+def fast_transform_movie(movie_dict: dict) -> TransformedDocument:
+    # Same document as pydantic_transform_movie, built straight from the row
+    # with a single pass over the persons and serialized by orjson
+    persons: Dict[str, List[dict]] = {'directors': [], 'actors': [], 'writers': []}
+    for person in movie_dict['persons']:
+        role_key = ROLE_KEYS.get(person['person_role'])
+        if role_key is not None:
+            persons[role_key].append({'id': person['person_id'], 'full_name': person['person_name']})
+
+    rating = movie_dict['rating']
+    document = {
+        'id': movie_dict['id'],
+        'imdb_rating': float(rating) if rating is not None else None,
+        'genres': movie_dict['genres'],
+        'title': movie_dict['title'],
+        'description': movie_dict['description'],
+        'creation_date': movie_dict['creation_date'],
+        'type': movie_dict['type'],
+        'directors': persons['directors'],
+        'actors_names': [actor['full_name'] for actor in persons['actors']],
+        'writers_names': [writer['full_name'] for writer in persons['writers']],
+        'actors': persons['actors'],
+        'writers': persons['writers'],
+    }
+    return movie_dict['id'], orjson.dumps(document)
+
+
+TRANSFORM_ENGINES: Dict[str, Callable[[dict], TransformedDocument]] = {
+    'pydantic': pydantic_transform_movie,
+    'fast': fast_transform_movie,
+}